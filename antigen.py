@@ -1,10 +1,14 @@
 # antigen.py
 
-import json
+import orjson
+import numpy as np
 import pandas as pd
 import re
-import difflib
+from collections import namedtuple
+from functools import lru_cache
+from rapidfuzz import process, fuzz
 from tqdm import tqdm
+from pipeline_utils import write_json_array
 
 # ------------------------------------
 # CONFIGURATION
@@ -25,18 +29,30 @@ CONFIG = {
 # ------------------------------------
 # UTILITIES
 # ------------------------------------
-def normalize_symbol(s):
-    return re.sub(r'[^A-Z0-9]', '', str(s).upper())
+_NORM_RE = re.compile(r'[^A-Z0-9]')
+_SPLIT_RE = re.compile(r'[|,]')
+
+
+@lru_cache(maxsize=None)
+def normalize_symbol(s, _sub=_NORM_RE.sub):
+    return _sub('', str(s).upper())
 
 
 def load_json(path):
-    with open(path, "r") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
 
 
 def save_json(data, path, indent=2):
-    with open(path, "w") as f:
-        json.dump(data, f, indent=indent)
+    """
+    Writes `data` as JSON with orjson. Indented top-level lists are streamed one
+    record at a time by write_json_array rather than serialised into a single buffer.
+    """
+    if indent and isinstance(data, list):
+        write_json_array(data, path)
+        return
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0))
 
 
 def expand_antigen_name(name):
@@ -44,18 +60,24 @@ def expand_antigen_name(name):
     Splits strings like "Folate Receptor Alpha (FRα)" into ["Folate Receptor Alpha", "FRα"]
     Returns a list with just the name if no parentheses.
     """
-    match = re.match(r"^(.*?)\s*\((.*?)\)$", name)
-    if match:
-        outside, inside = match.groups()
-        return [outside.strip(), inside.strip()]
+    open_idx = name.find("(")
+    if open_idx != -1 and name.endswith(")"):
+        return [name[:open_idx].strip(), name[open_idx + 1:-1].strip()]
     return [name.strip()]
 
 
 # ------------------------------------
 # HGNC PROCESSING
 # ------------------------------------
+HGNC_COLUMNS = ["symbol", "alias_symbol", "hgnc_id", "ensembl_gene_id", "locus_type", "gene_group"]
+HGNCRow = namedtuple("HGNCRow", HGNC_COLUMNS)
+
+
 def load_hgnc_data(tsv_path):
-    df = pd.read_csv(tsv_path, sep="\t", low_memory=False)
+    # locus_type has a few dozen distinct values, so filter it as a categorical
+    dtypes = {column: str for column in HGNC_COLUMNS}
+    dtypes["locus_type"] = "category"
+    df = pd.read_csv(tsv_path, sep="\t", usecols=HGNC_COLUMNS, dtype=dtypes)
     excluded_loci = [
         "pseudogene", "RNA, long non-coding", "RNA, micro", "RNA, transfer", "RNA, small nucleolar",
         "immunoglobulin pseudogene", "T cell receptor pseudogene", "RNA, ribosomal", "RNA, small nuclear",
@@ -65,57 +87,95 @@ def load_hgnc_data(tsv_path):
 
 
 def build_hgnc_maps(hgnc_df):
-    symbol_map = {normalize_symbol(row["symbol"]): row for _, row in hgnc_df.iterrows()}
+    symbols = hgnc_df["symbol"].to_numpy()
+    alias_strs = hgnc_df["alias_symbol"].fillna("").to_numpy()
+    rows = [HGNCRow(*cols) for cols in zip(*(hgnc_df[c].to_numpy() for c in HGNC_COLUMNS))]
+
+    norm = normalize_symbol
+    split = _SPLIT_RE.split
+    symbol_map = {}
     alias_map = {}
-    for _, row in hgnc_df.iterrows():
-        aliases = re.split(r"[|,]", str(row.get("alias_symbol", "")))
-        for alias in aliases:
-            alias_clean = normalize_symbol(alias)
+    for sym, alias_str, row in zip(symbols, alias_strs, rows):
+        symbol_map[norm(sym)] = row
+        for alias in split(str(alias_str)):
+            alias_clean = norm(alias)
             if alias_clean:
                 alias_map[alias_clean] = row
-    return symbol_map, alias_map
+    # A key that is both an approved symbol and another gene's alias resolves to the symbol's row
+    combined_map = dict(alias_map)
+    combined_map.update(symbol_map)
+    # Fuzzy choices in sorted order, so scoring never depends on how the maps were merged
+    all_keys = sorted(combined_map)
+    return symbol_map, alias_map, combined_map, all_keys
 
 
-def query_hgnc(symbol, symbol_map, alias_map, cutoff=0.85, original=None):
-    cleaned = normalize_symbol(symbol)
+def batch_fuzzy_match(queries, choices, cutoff=0.85, chunk_size=64, prefer_greatest=False):
+    """
+    Finds the best fuzzy choice for every query with multi-threaded process.cdist calls
+    instead of one extractOne scan per query. Queries are scored in chunks to bound
+    the size of the score matrix. Returns {query: choice_index} for queries that reach
+    the cutoff. Choices tied at the top score resolve to the earliest one, or with
+    prefer_greatest to the lexicographically greatest, as difflib.get_close_matches does.
+    """
+    hits = {}
+    for start in range(0, len(queries), chunk_size):
+        chunk = queries[start:start + chunk_size]
+        scores = process.cdist(chunk, choices, scorer=fuzz.ratio, score_cutoff=cutoff * 100, workers=-1)
+        best = scores.max(axis=1, initial=0)
+        for row, query in enumerate(chunk):
+            if best[row] < cutoff * 100:
+                continue
+            tied = np.flatnonzero(scores[row] == best[row])
+            hits[query] = int(max(tied, key=choices.__getitem__) if prefer_greatest else tied[0])
+    return hits
+
+
+def unknown_result(symbol):
+    return {
+        "input": symbol,
+        "hgnc_symbol": None,
+        "hgnc_id": None,
+        "ensembl_gene_id": None,
+        "synonyms": [],
+        "locus_type": None,
+        "gene_group": [],
+        "status": "unknown"
+    }
+
 
-    if cleaned in symbol_map:
-        row = symbol_map[cleaned]
-        status = "canonical"
-    elif cleaned in alias_map:
-        row = alias_map[cleaned]
+def query_hgnc(symbol, symbol_map, alias_map, combined_map, all_keys, cutoff=0.85, original=None, fuzzy_hits=None):
+    cleaned = normalize_symbol(symbol)
+    if not cleaned:
+        # Punctuation-only input: nothing to look up, and fuzzy scoring would be noise
+        return unknown_result(symbol)
+
+    row = symbol_map.get(cleaned)
+    status = "canonical"
+    if row is None:
+        row = alias_map.get(cleaned)
         status = "alias_match"
-    else:
-        all_keys = list(set(symbol_map.keys()) | set(alias_map.keys()))
-        match = difflib.get_close_matches(cleaned, all_keys, n=1, cutoff=cutoff)
-        if match:
-            key = match[0]
-            row = symbol_map.get(key)
-            if row is None:
-                row = alias_map.get(key)
+    if row is None:
+        if fuzzy_hits is not None:
+            idx = fuzzy_hits.get(cleaned)
+        else:
+            idx = batch_fuzzy_match([cleaned], all_keys, cutoff, prefer_greatest=True).get(cleaned)
+        key = all_keys[idx] if idx is not None else None
+        if key is not None:
+            row = combined_map[key]
             status = "fuzzy_match"
         else:
-            return {
-                "input": symbol,
-                "hgnc_symbol": None,
-                "hgnc_id": None,
-                "ensembl_gene_id": None,
-                "synonyms": [],
-                "locus_type": None,
-                "gene_group": [],
-                "status": "unknown"
-            }
-
-    gene_group_raw = row.get("gene_group")
+            return unknown_result(symbol)
+
+    gene_group_raw = row.gene_group
     gene_group_list = [g.strip() for g in str(gene_group_raw).split("|") if g.strip()] if pd.notna(gene_group_raw) else []
 
     return {
         "input": symbol,
-        "hgnc_symbol": row["symbol"],
-        "hgnc_id": row["hgnc_id"],
-        "ensembl_gene_id": row.get("ensembl_gene_id"),
-        "synonyms": re.split(r"[|,]", str(row.get("alias_symbol", ""))),
-        "locus_type": row.get("locus_type"),
+        "hgnc_symbol": row.symbol,
+        "hgnc_id": row.hgnc_id,
+        "ensembl_gene_id": row.ensembl_gene_id,
+        "synonyms": _SPLIT_RE.split(str(row.alias_symbol)),
+        "locus_type": row.locus_type,
         "gene_group": gene_group_list,
         "status": status
     }
@@ -124,99 +184,107 @@ def query_hgnc(symbol, symbol_map, alias_map, cutoff=0.85, original=None):
 # ------------------------------------
 # TACA PROCESSING
 # ------------------------------------
-def query_taca(symbol, taca_db, cutoff=0.85):
-    candidates = []
+def build_taca_index(taca_db):
+    """
+    Flattens the TACA families into parallel lists: lower-cased subtype names to
+    score against, and the (subtype, family) pair each one came from.
+    """
+    choices = []
+    entries = []
     for family in taca_db:
         for subtype in family["subtypes"]:
-            ratio = difflib.SequenceMatcher(None, symbol.lower(), subtype.lower()).ratio()
-            if ratio >= cutoff:
-                candidates.append({
-                    "input": symbol,
-                    "matched_subtype": subtype,
-                    "matched_family": family["family"],
-                    "references": family.get("references", []),
-                    "score": ratio
-                })
-    if candidates:
-        # Return the best match
-        best = sorted(candidates, key=lambda x: -x["score"])[0]
-        return {
-            "input": best["input"],
-            "hgnc_symbol": None,
-            "hgnc_id": None,
-            "ensembl_gene_id": None,
-            "synonyms": [],
-            "locus_type": "TACA",
-            "gene_group": [best["matched_family"]],
-            "status": "taca_match",
-            "taca_subtype": best["matched_subtype"],
-            "references": best["references"]
-        }
+            choices.append(subtype.lower())
+            entries.append((subtype, family))
+    return choices, entries
+
+
+def query_taca(symbol, taca_index, cutoff=0.85, taca_hits=None):
+    choices, entries = taca_index
+    if taca_hits is not None:
+        idx = taca_hits.get(symbol.lower())
     else:
+        match = process.extractOne(symbol.lower(), choices, scorer=fuzz.ratio, score_cutoff=cutoff * 100)
+        idx = match[2] if match is not None else None
+    if idx is None:
         return None
 
+    subtype, family = entries[idx]
+    return {
+        "input": symbol,
+        "hgnc_symbol": None,
+        "hgnc_id": None,
+        "ensembl_gene_id": None,
+        "synonyms": [],
+        "locus_type": "TACA",
+        "gene_group": [family["family"]],
+        "status": "taca_match",
+        "taca_subtype": subtype,
+        "references": family.get("references", [])
+    }
+
 # ------------------------------------
 # JSON PROCESSING
 # ------------------------------------
+def explode_antigens(data):
+    """
+    Flattens data -> extractedDrugs -> targetAntigenCanonicalized into one row
+    per (drug, antigen) pair. Returns the flat list of drug dicts alongside a
+    DataFrame whose "drug_idx" column indexes into it.
+    """
+    drugs = [drug for entry in data for drug in entry.get("extractedDrugs", [])]
+    flat = pd.DataFrame({
+        "drug_idx": range(len(drugs)),
+        "antigen": [drug.get("targetAntigenCanonicalized") for drug in drugs]
+    }).explode("antigen", ignore_index=True)
+    flat = flat[flat["antigen"].map(lambda a: isinstance(a, str))]
+    return drugs, flat
+
+
 def extract_unique_antigens(data):
-    antigens = []
-    for entry in data:
-        for drug in entry.get("extractedDrugs", []):
-            ag = drug.get("targetAntigenCanonicalized")
-            if isinstance(ag, str):
-                antigens.append(ag)
-            elif isinstance(ag, list):
-                antigens.extend([a for a in ag if isinstance(a, str)])
-    return sorted(set(antigens))
+    _, flat = explode_antigens(data)
+    return sorted(flat["antigen"].unique())
+
+
+def build_match_entry(result):
+    status = result.get("status")
+    is_match = status != "unknown"
+    match_entry = {
+        "input": result.get("input"),
+        "is_match": is_match,
+        "match_type": None,
+        "HGNC": None,
+        "TACA": None
+    }
+
+    if status == "taca_match":
+        match_entry["match_type"] = "TACA"
+        match_entry["TACA"] = {
+            "subtype": result.get("taca_subtype"),
+            "family": ", ".join(result.get("gene_group", [])) if result.get("gene_group") else None
+        }
+    elif is_match:
+        match_entry["match_type"] = "HGNC"
+        match_entry["HGNC"] = {
+            "symbol": result.get("hgnc_symbol"),
+            "hgnc_id": result.get("hgnc_id"),
+            "ensembl_gene_id": result.get("ensembl_gene_id"),
+            "synonyms": result.get("synonyms"),
+            "locus": result.get("locus_type"),
+            "family": ", ".join(result.get("gene_group", [])) if result.get("gene_group") else None
+        }
+
+    return match_entry
 
 
 def enrich_json(data, hgnc_lookup_results):
-    for entry in data:
-        for drug in entry.get("extractedDrugs", []):
-            ag = drug.get("targetAntigenCanonicalized")
-            match_results = []
-
-            if isinstance(ag, str):
-                results = [hgnc_lookup_results.get(ag)]
-            elif isinstance(ag, list):
-                results = [hgnc_lookup_results.get(a) for a in ag if isinstance(a, str)]
-            else:
-                results = []
-
-            for result in results:
-                if not result:
-                    continue
-
-                status = result.get("status")
-                is_match = status != "unknown"
-                match_entry = {
-                    "input": result.get("input"),
-                    "is_match": is_match,
-                    "match_type": None,
-                    "HGNC": None,
-                    "TACA": None
-                }
-
-                if status == "taca_match":
-                    match_entry["match_type"] = "TACA"
-                    match_entry["TACA"] = {
-                        "subtype": result.get("taca_subtype"),
-                        "family": ", ".join(result.get("gene_group", [])) if result.get("gene_group") else None
-                    }
-                elif is_match:
-                    match_entry["match_type"] = "HGNC"
-                    match_entry["HGNC"] = {
-                        "symbol": result.get("hgnc_symbol"),
-                        "hgnc_id": result.get("hgnc_id"),
-                        "ensembl_gene_id": result.get("ensembl_gene_id"),
-                        "synonyms": result.get("synonyms"),
-                        "locus": result.get("locus_type"),
-                        "family": ", ".join(result.get("gene_group", [])) if result.get("gene_group") else None
-                    }
-
-                match_results.append(match_entry)
-
-            drug["targetOntology"] = match_results
+    # Look each row's result up in one vectorised map, but build a fresh entry per row
+    # so no two drugs share (and can mutate) the same match entry
+    drugs, flat = explode_antigens(data)
+    results = flat["antigen"].map({ag: result for ag, result in hgnc_lookup_results.items() if result})
+    per_drug = results.dropna().map(build_match_entry).groupby(flat["drug_idx"]).agg(list).to_dict()
+
+    for idx, drug in enumerate(drugs):
+        drug["targetOntology"] = per_drug.get(idx, [])
 
     return data
 
@@ -270,11 +338,10 @@ def export_unknowns(minimal_data, output_path):
 # ------------------------------------
 def main():
     print("🔄 Loading HGNC data...")
-    hgnc_df = load_hgnc_data(CONFIG["HGNC_TSV"])
-    symbol_map, alias_map = build_hgnc_maps(hgnc_df)
+    symbol_map, alias_map, combined_map, all_keys = build_hgnc_maps(load_hgnc_data(CONFIG["HGNC_TSV"]))
     
     print("🔄 Loading TACA data...")
-    taca_db = load_json(CONFIG["TACA_JSON"])["TACA_classifications"]
+    taca_index = build_taca_index(load_json(CONFIG["TACA_JSON"])["TACA_classifications"])
 
     print("📥 Loading input JSON...")
     data = load_json(CONFIG["JSON_INPUT"])
@@ -284,27 +351,38 @@ def main():
     print(f"✅ Found {len(unique_antigens)} unique antigens")
 
     print("🔍 Querying HGNC...")
+    candidates_by_antigen = {}
+    for ag in unique_antigens:
+        candidates = expand_antigen_name(ag) or [ag]
+        # The full name only needs its own lookup if it normalises differently from its parts
+        if normalize_symbol(ag) not in {normalize_symbol(c) for c in candidates}:
+            candidates.append(ag)
+        candidates_by_antigen[ag] = candidates
+
+    # Score every symbol that misses the exact maps in one batched fuzzy pass
+    misses = {normalize_symbol(c) for candidates in candidates_by_antigen.values() for c in candidates}
+    misses = sorted(misses - combined_map.keys() - {""})
+    fuzzy_hits = batch_fuzzy_match(misses, all_keys, CONFIG["FUZZY_CUTOFF"], prefer_greatest=True)
+
     hgnc_results = {}
     for ag in tqdm(unique_antigens, desc="HGNC Lookup"):
-        candidates = expand_antigen_name(ag)
-        if not candidates:
-            candidates = [ag]
-            
+        candidates = candidates_by_antigen[ag]
         best_result = None
         for candidate in candidates:
-            result = query_hgnc(candidate, symbol_map, alias_map, CONFIG["FUZZY_CUTOFF"], original=ag)
+            result = query_hgnc(candidate, symbol_map, alias_map, combined_map, all_keys, CONFIG["FUZZY_CUTOFF"], original=ag, fuzzy_hits=fuzzy_hits)
             if result["status"] != "unknown":
                 best_result = result
                 break
 
-        if not best_result:
-            best_result = query_hgnc(ag, symbol_map, alias_map, CONFIG["FUZZY_CUTOFF"], original=ag)
-            if best_result["status"] == "unknown":
-                taca_result = query_taca(ag, taca_db, 0.50)
-                if taca_result:
-                    best_result = taca_result
+        hgnc_results[ag] = best_result or unknown_result(ag)
 
-        hgnc_results[ag] = best_result
+    # Fall back to TACA for antigens HGNC could not resolve, scored in one batch
+    unresolved = [ag for ag, result in hgnc_results.items() if result["status"] == "unknown"]
+    taca_hits = batch_fuzzy_match(sorted({ag.lower() for ag in unresolved}), taca_index[0], 0.50)
+    for ag in unresolved:
+        taca_result = query_taca(ag, taca_index, 0.50, taca_hits=taca_hits)
+        if taca_result:
+            hgnc_results[ag] = taca_result
 
     print("🧩 Enriching JSON with HGNC results...")
     enriched_data = enrich_json(data, hgnc_results)
@@ -7,12 +7,26 @@ research-based categories including target antigen expression, pharmacokinetic p
 multigene expression signatures, resistance mechanisms, and molecular imaging.
 """
 
-import json
+import orjson
+import os
 import re
+import sys
+import ahocorasick
 from pathlib import Path
 from collections import defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from typing import Dict, List, Optional, Tuple
-from difflib import SequenceMatcher
+from pipeline_utils import build_variation_automaton, match_partial_variation, write_json_array
+
+# Below this many distinct strategies, worker start-up costs more than it saves
+PARALLEL_MIN_STRATEGIES = 2000
+
+# Fields kept per drug in the minimal individual output
+MINIMAL_DRUG_FIELDS = (
+    "drugName", "biomarkerStrategyCleaned", "biomarkerStrategyOriginal", "biomarkerStrategyCategories",
+    "biomarkerTechnologies", "biomarkerMolecules", "biomarkerComplexity", "biomarkerStrategyConfidence"
+)
 
 class BiomarkerStrategyCleaner:
     def __init__(self):
@@ -76,15 +90,85 @@ class BiomarkerStrategyCleaner:
             "multiplex biomarker panel": "Multiplex biomarker panel"
         }
         
+        # Automaton over the variation keys for the partial-match fallback
+        self.strategy_variation_automaton = build_variation_automaton(self.strategy_variations)
+        self.strategy_variations_joined = "\n".join(self.strategy_variations)
+        
+        # Common biomarker technologies
+        self.technologies = [
+            "ELISA", "IHC", "FACS", "Flow cytometry", "PCR", "qPCR", "RT-PCR",
+            "Western blot", "Mass spectrometry", "Nanostring", "Microarray",
+            "RNA-seq", "Next-generation sequencing", "NGS", "PET", "MRI", "CT",
+            "Liquid biopsy", "CTC", "ctDNA", "Proteomics", "Transcriptomics"
+        ]
+        
+        # Flat reverse index from each lowercased keyword to the categories and
+        # technologies it signals, and a single automaton over all of them
+        self.keyword_index = self.build_keyword_index()
+        self.keyword_automaton = self.build_keyword_automaton()
+        
+        # Biomarker name tokens: abbreviations like EGFR, HER2 (group 1) or
+        # single title-case words (group 2); two-word names are paired from the latter
+        self.biomarker_token_pattern = re.compile(r'\b(?:([A-Z]{2,4}\d*)|([A-Z][a-z]+))\b')
+        
+        # Profile shared by every missing or "unknown" strategy
+        self.unknown_profile = ("unknown", {category: False for category in self.biomarker_categories}, [], [], 0)
+        
+        # Memoize the per-string helpers; the same strategies repeat across many drugs
+        self.clean_biomarker_strategy = lru_cache(maxsize=None)(self.clean_biomarker_strategy)
+        self.categorize_biomarker_strategy = lru_cache(maxsize=None)(self.categorize_biomarker_strategy)
+        self.extract_key_technologies = lru_cache(maxsize=None)(self.extract_key_technologies)
+        self.extract_key_biomarkers = lru_cache(maxsize=None)(self.extract_key_biomarkers)
+        self.scan_strategy = lru_cache(maxsize=None)(self.scan_strategy)
+        
+    def build_keyword_index(self) -> Dict[str, Tuple[frozenset, frozenset]]:
+        """Map each lowercased keyword to the (categories, technologies) it signals"""
+        keyword_categories = defaultdict(set)
+        keyword_technologies = defaultdict(set)
+        for category, category_info in self.biomarker_categories.items():
+            for keyword in category_info["keywords"]:
+                keyword_categories[keyword].add(category)
+        for tech in self.technologies:
+            keyword_technologies[tech.lower()].add(tech)
+        
+        return {
+            keyword: (frozenset(keyword_categories.get(keyword, ())), frozenset(keyword_technologies.get(keyword, ())))
+            for keyword in keyword_categories.keys() | keyword_technologies.keys()
+        }
+    
+    def build_keyword_automaton(self) -> ahocorasick.Automaton:
+        """Build an Aho-Corasick automaton over the keyword index"""
+        automaton = ahocorasick.Automaton()
+        for keyword, tags in self.keyword_index.items():
+            automaton.add_word(keyword, tags)
+        automaton.make_automaton()
+        return automaton
+    
     def load_data(self, file_path: str) -> List[Dict]:
         """Load the input JSON data"""
-        with open(file_path, 'r') as f:
-            return json.load(f)
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
     
     def save_data(self, data: List[Dict], file_path: str):
         """Save the enriched data"""
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        with open(file_path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    
+    def save_minimal_output(self, data: List[Dict], file_path: str):
+        """
+        Save the id and biomarker fields of each entry. Entries are trimmed and
+        written one by one, so no trimmed copy of the dataset is held in memory.
+        """
+        write_json_array((
+            {
+                "id": entry.get("id"),
+                "extractedDrugs": [
+                    {field: drug.get(field) for field in MINIMAL_DRUG_FIELDS}
+                    for drug in entry.get("extractedDrugs", [])
+                ]
+            }
+            for entry in data
+        ), file_path)
     
     def clean_biomarker_strategy(self, strategy: str) -> str:
         """Clean and standardize biomarker strategy descriptions"""
@@ -96,14 +180,16 @@ class BiomarkerStrategyCleaner:
         
         # Check for exact matches in variations
         strategy_lower = strategy_clean.lower()
-        for variation, standard in self.strategy_variations.items():
-            if strategy_lower == variation:
-                return standard
+        standard = self.strategy_variations.get(strategy_lower)
+        if standard is not None:
+            return standard
         
         # Check for partial matches
-        for variation, standard in self.strategy_variations.items():
-            if variation in strategy_lower or strategy_lower in variation:
-                return standard
+        standard = match_partial_variation(
+            strategy_lower, self.strategy_variations, self.strategy_variation_automaton, self.strategy_variations_joined
+        )
+        if standard is not None:
+            return standard
         
         # If no match found, return the cleaned original
         return strategy_clean
@@ -113,111 +199,119 @@ class BiomarkerStrategyCleaner:
         if not strategy or strategy == "unknown":
             return {category: False for category in self.biomarker_categories.keys()}
         
-        strategy_lower = strategy.lower()
-        categories = {}
+        found = set()
+        for _, (keyword_categories, _) in self.keyword_automaton.iter(strategy.lower()):
+            found |= keyword_categories
+            if len(found) == len(self.biomarker_categories):
+                break
         
-        for category, category_info in self.biomarker_categories.items():
-            keywords = category_info["keywords"]
-            categories[category] = any(keyword in strategy_lower for keyword in keywords)
-        
-        return categories
+        return {category: category in found for category in self.biomarker_categories}
     
     def extract_key_technologies(self, strategy: str) -> List[str]:
         """Extract key technologies mentioned in the strategy"""
         if not strategy or strategy == "unknown":
             return []
         
-        # Common biomarker technologies
-        technologies = [
-            "ELISA", "IHC", "FACS", "Flow cytometry", "PCR", "qPCR", "RT-PCR",
-            "Western blot", "Mass spectrometry", "Nanostring", "Microarray",
-            "RNA-seq", "Next-generation sequencing", "NGS", "PET", "MRI", "CT",
-            "Liquid biopsy", "CTC", "ctDNA", "Proteomics", "Transcriptomics"
-        ]
-        
-        found_technologies = []
-        strategy_lower = strategy.lower()
-        
-        for tech in technologies:
-            if tech.lower() in strategy_lower:
-                found_technologies.append(tech)
+        found = set()
+        for _, (_, keyword_technologies) in self.keyword_automaton.iter(strategy.lower()):
+            found |= keyword_technologies
         
-        return found_technologies
+        return [tech for tech in self.technologies if tech in found]
     
     def extract_key_biomarkers(self, strategy: str) -> List[str]:
         """Extract specific biomarker names mentioned in the strategy"""
         if not strategy or strategy == "unknown":
             return []
         
-        # Common biomarker patterns
-        biomarker_patterns = [
-            r'\b[A-Z]{2,4}\d*\b',  # Abbreviations like EGFR, HER2, etc.
-            r'\b[A-Z][a-z]+\s+[A-Z][a-z]+\b',  # Two-word names
-            r'\b[A-Z][a-z]+\b'  # Single word names
-        ]
-        
-        biomarkers = []
-        for pattern in biomarker_patterns:
-            matches = re.findall(pattern, strategy)
-            biomarkers.extend(matches)
-        
-        return list(set(biomarkers))
+        biomarkers = set()
+        previous_word = None
+        for match in self.biomarker_token_pattern.finditer(strategy):
+            biomarkers.add(sys.intern(match.group()))
+            if match.group(2) is None:
+                previous_word = None
+            elif previous_word is not None and strategy[previous_word.end():match.start()].isspace():
+                # Two title-case words separated only by whitespace, paired left to right
+                biomarkers.add(sys.intern(strategy[previous_word.start():match.end()]))
+                previous_word = None
+            else:
+                previous_word = match
+        
+        return list(biomarkers)
     
-    def calculate_strategy_complexity(self, strategy: str) -> int:
-        """Calculate complexity score of biomarker strategy"""
+    def scan_strategy(self, strategy: str) -> Tuple[Dict[str, bool], List[str], List[str], int]:
+        """
+        Analyse a cleaned strategy in one pass over its keywords.
+        Returns (categories, technologies, biomarkers, complexity).
+        """
         if not strategy or strategy == "unknown":
-            return 0
-        
-        # Simple complexity scoring
-        complexity = 0
-        
-        # Count different categories
-        categories = self.categorize_biomarker_strategy(strategy)
-        category_count = sum(categories.values())
-        complexity += category_count * 2
+            return {category: False for category in self.biomarker_categories}, [], [], 0
         
-        # Count technologies
-        technologies = self.extract_key_technologies(strategy)
-        complexity += len(technologies)
+        # One automaton pass collects both category and technology hits
+        found_categories = set()
+        found_technologies = set()
+        for _, (keyword_categories, keyword_technologies) in self.keyword_automaton.iter(strategy.lower()):
+            found_categories |= keyword_categories
+            found_technologies |= keyword_technologies
         
-        # Count biomarkers
+        categories = {category: category in found_categories for category in self.biomarker_categories}
+        technologies = [tech for tech in self.technologies if tech in found_technologies]
         biomarkers = self.extract_key_biomarkers(strategy)
-        complexity += len(biomarkers)
         
-        # Length factor
-        complexity += len(strategy.split()) // 10
+        # Simple complexity scoring: categories, technologies, biomarkers and a length factor
+        complexity = len(found_categories) * 2 + len(technologies) + len(biomarkers) + len(strategy.split()) // 10
         
-        return complexity
+        return categories, technologies, biomarkers, complexity
     
-    def build_biomarker_dictionary(self, data: List[Dict]) -> Dict:
-        """Build a dictionary of all unique biomarker strategies and their frequencies"""
+    def calculate_strategy_complexity(self, strategy: str) -> int:
+        """Calculate complexity score of biomarker strategy"""
+        return self.scan_strategy(strategy)[3]
+    
+    def profile_strategy(self, strategy: str) -> Tuple[str, Dict[str, bool], List[str], List[str], int]:
+        """Clean a raw strategy and return (cleaned, categories, technologies, biomarkers, complexity)"""
+        # Most drugs have no strategy; skip cleaning and scanning entirely for them
+        if not strategy or strategy == "unknown":
+            return self.unknown_profile
+        
+        # Intern the cleaned string; the same value is shared by many drugs and dictionary keys
+        cleaned_strategy = sys.intern(self.clean_biomarker_strategy(strategy))
+        return (cleaned_strategy,) + self.scan_strategy(cleaned_strategy)
+    
+    def profile_strategies(self, strategies, jobs: Optional[int] = None) -> Dict[str, Tuple]:
+        """Profile distinct strategies, sharding them across processes for large inputs"""
+        strategies = list(strategies)
+        jobs = jobs or os.cpu_count() or 1
+        if jobs <= 1 or len(strategies) < PARALLEL_MIN_STRATEGIES:
+            return {strategy: self.profile_strategy(strategy) for strategy in strategies}
+        
+        chunksize = max(1, len(strategies) // (4 * jobs))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_profile_worker) as executor:
+            profiles = executor.map(_profile_strategy, strategies, chunksize=chunksize)
+            return dict(zip(strategies, profiles))
+    
+    def tally_strategies(self, strategy_multiplicity: Counter, profiles: Dict[str, Tuple]) -> Dict:
+        """
+        Count strategies, categories and technologies from the number of drugs per
+        distinct raw strategy and the profile of each; shared by enrich_data and
+        build_biomarker_dictionary.
+        """
         strategy_counts = Counter()
         category_counts = defaultdict(lambda: {"count": 0, "examples": []})
         technology_counts = Counter()
         
-        for entry in data:
-            for drug in entry.get("extractedDrugs", []):
-                strategy = drug.get("biomarkerStrategy", "unknown")
-                
-                # Clean the strategy
-                cleaned_strategy = self.clean_biomarker_strategy(strategy)
-                
-                if cleaned_strategy != "unknown":
-                    strategy_counts[cleaned_strategy] += 1
-                    self.known_strategies.add(cleaned_strategy)
-                
-                # Categorize by ADC-specific categories
-                categories = self.categorize_biomarker_strategy(cleaned_strategy)
-                for category, is_present in categories.items():
-                    if is_present:
-                        category_counts[category]["count"] += 1
-                        if cleaned_strategy not in category_counts[category]["examples"]:
-                            category_counts[category]["examples"].append(cleaned_strategy)
-                
-                # Count technologies
-                technologies = self.extract_key_technologies(cleaned_strategy)
-                for tech in technologies:
-                    technology_counts[tech] += 1
+        for original_strategy, drug_count in strategy_multiplicity.items():
+            cleaned_strategy, categories, technologies, _, _ = profiles[original_strategy]
+            
+            if cleaned_strategy != "unknown":
+                strategy_counts[cleaned_strategy] += drug_count
+                self.known_strategies.add(cleaned_strategy)
+            
+            for category, is_present in categories.items():
+                if is_present:
+                    category_counts[category]["count"] += drug_count
+                    if cleaned_strategy not in category_counts[category]["examples"]:
+                        category_counts[category]["examples"].append(cleaned_strategy)
+            
+            technology_counts.update(dict.fromkeys(technologies, drug_count))
         
         return {
             "strategies": dict(strategy_counts),
@@ -225,41 +319,46 @@ class BiomarkerStrategyCleaner:
             "technologies": dict(technology_counts)
         }
     
-    def enrich_data(self, data: List[Dict]) -> List[Dict]:
-        """Enrich the data with cleaned biomarker strategies and additional metadata"""
+    def build_biomarker_dictionary(self, data: List[Dict]) -> Dict:
+        """Build a dictionary of all unique biomarker strategies and their frequencies"""
+        strategy_multiplicity = Counter(
+            drug.get("biomarkerStrategy", "unknown")
+            for entry in data
+            for drug in entry.get("extractedDrugs", [])
+        )
+        return self.tally_strategies(strategy_multiplicity, self.profile_strategies(strategy_multiplicity))
+    
+    def enrich_data(self, data: List[Dict], jobs: Optional[int] = None) -> List[Dict]:
+        """
+        Enrich the data with cleaned biomarker strategies and additional metadata.
+        jobs sets the number of worker processes (default: all cores); pass 1 to stay in-process.
+        """
         print("🧬 Enriching biomarker strategy data...")
         
-        enriched_count = 0
-        unknown_count = 0
-        
-        for entry in data:
-            for drug in entry.get("extractedDrugs", []):
-                original_strategy = drug.get("biomarkerStrategy", "unknown")
-                
-                # Clean the strategy
-                cleaned_strategy = self.clean_biomarker_strategy(original_strategy)
-                
-                # Categorize the strategy
-                categories = self.categorize_biomarker_strategy(cleaned_strategy)
-                
-                # Extract additional information
-                technologies = self.extract_key_technologies(cleaned_strategy)
-                biomarkers = self.extract_key_biomarkers(cleaned_strategy)
-                complexity = self.calculate_strategy_complexity(cleaned_strategy)
-                
-                # Add enriched fields
-                drug["biomarkerStrategyCleaned"] = cleaned_strategy
-                drug["biomarkerStrategyOriginal"] = original_strategy
-                drug["biomarkerStrategyCategories"] = categories
-                drug["biomarkerTechnologies"] = technologies
-                drug["biomarkerMolecules"] = biomarkers
-                drug["biomarkerComplexity"] = complexity
-                drug["biomarkerStrategyConfidence"] = 1 if cleaned_strategy != "unknown" else 0
-                
-                if cleaned_strategy == "unknown":
-                    unknown_count += 1
-                else:
-                    enriched_count += 1
+        # Count drugs per distinct strategy (in first-seen order), then clean and
+        # analyse each distinct strategy once; the per-drug loop only looks results up
+        drugs = [drug for entry in data for drug in entry.get("extractedDrugs", [])]
+        drug_strategies = [drug.get("biomarkerStrategy", "unknown") for drug in drugs]
+        strategy_multiplicity = Counter(drug_strategies)
+        profiles = self.profile_strategies(strategy_multiplicity, jobs)
+        
+        for drug, original_strategy in zip(drugs, drug_strategies):
+            cleaned_strategy, categories, technologies, biomarkers, complexity = profiles[original_strategy]
+            # Profiles are memoised and shared, so each drug gets its own copies of the containers
+            drug.update({
+                "biomarkerStrategyCleaned": cleaned_strategy,
+                "biomarkerStrategyOriginal": original_strategy,
+                "biomarkerStrategyCategories": dict(categories),
+                "biomarkerTechnologies": list(technologies),
+                "biomarkerMolecules": list(biomarkers),
+                "biomarkerComplexity": complexity,
+                "biomarkerStrategyConfidence": 1 if cleaned_strategy != "unknown" else 0
+            })
+        
+        # Build the biomarker dictionary from the per-strategy drug counts
+        self.biomarker_dictionary = self.tally_strategies(strategy_multiplicity, profiles)
+        enriched_count = sum(self.biomarker_dictionary["strategies"].values())
+        unknown_count = len(drugs) - enriched_count
         
         print(f"   ✅ Enriched {enriched_count} biomarker strategies")
         print(f"   ⚠️  {unknown_count} biomarker strategies remain unknown")
@@ -268,9 +367,10 @@ class BiomarkerStrategyCleaner:
     
     def generate_biomarker_dictionary(self, data: List[Dict]) -> Dict:
         """Generate a comprehensive biomarker strategy dictionary"""
-        biomarker_dict = self.build_biomarker_dictionary(data)
-        
-        # Add metadata
+        return self.format_biomarker_dictionary(self.build_biomarker_dictionary(data))
+    
+    def format_biomarker_dictionary(self, biomarker_dict: Dict) -> Dict:
+        """Add metadata to strategy, category and technology counts, e.g. those enrich_data left in self.biomarker_dictionary"""
         dictionary = {
             "metadata": {
                 "total_strategies": len(biomarker_dict["strategies"]),
@@ -296,9 +396,9 @@ class BiomarkerStrategyCleaner:
         data = self.load_data(input_file)
         print(f"   ✅ Loaded {len(data)} entries")
         
-        # Build biomarker dictionary
-        print("📊 Building biomarker strategy dictionary...")
-        biomarker_dict = self.build_biomarker_dictionary(data)
+        # Enrich data, building the biomarker dictionary in the same pass
+        enriched_data = self.enrich_data(data)
+        biomarker_dict = self.biomarker_dictionary
         print(f"   ✅ Found {len(biomarker_dict['strategies'])} unique strategies")
         
         # Show top strategies
@@ -317,9 +417,6 @@ class BiomarkerStrategyCleaner:
         for tech, count in sorted(biomarker_dict["technologies"].items(), key=lambda x: x[1], reverse=True)[:10]:
             print(f"   • {tech}: {count} mentions")
         
-        # Enrich data
-        enriched_data = self.enrich_data(data)
-        
         # Save enriched data (only if explicitly requested)
         if output_file != "aacrArticle_biomarker_enriched.json":
             print(f"\n💾 Saving enriched data to {output_file}...")
@@ -333,35 +430,30 @@ class BiomarkerStrategyCleaner:
         dict_file = "dictionaries/biomarker/biomarker_strategy_dictionary.json"
         Path("dictionaries/biomarker").mkdir(parents=True, exist_ok=True)
         
-        full_dict = self.generate_biomarker_dictionary(data)
-        with open(dict_file, 'w') as f:
-            json.dump(full_dict, f, indent=2)
+        # enrich_data already counted this data, so format those counts instead of rebuilding them
+        full_dict = self.format_biomarker_dictionary(biomarker_dict)
+        with open(dict_file, 'wb') as f:
+            f.write(orjson.dumps(full_dict, option=orjson.OPT_INDENT_2))
         
         print(f"   ✅ Biomarker strategy dictionary saved to {dict_file}")
         
         # Save minimal individual output for unified pipeline debugging
         Path("individual_outputs").mkdir(parents=True, exist_ok=True)
-        minimal_output = []
-        for entry in data:
-            minimal_entry = {"id": entry.get("id"), "extractedDrugs": []}
-            for drug in entry.get("extractedDrugs", []):
-                minimal_drug = {
-                    "drugName": drug.get("drugName"),
-                    "biomarkerStrategyCleaned": drug.get("biomarkerStrategyCleaned"),
-                    "biomarkerStrategyOriginal": drug.get("biomarkerStrategyOriginal"),
-                    "biomarkerStrategyCategories": drug.get("biomarkerStrategyCategories"),
-                    "biomarkerTechnologies": drug.get("biomarkerTechnologies"),
-                    "biomarkerMolecules": drug.get("biomarkerMolecules"),
-                    "biomarkerComplexity": drug.get("biomarkerComplexity"),
-                    "biomarkerStrategyConfidence": drug.get("biomarkerStrategyConfidence")
-                }
-                minimal_entry["extractedDrugs"].append(minimal_drug)
-            minimal_output.append(minimal_entry)
-        with open("individual_outputs/biomarker_strategy_enriched.json", "w") as f:
-            json.dump(minimal_output, f, indent=2)
+        self.save_minimal_output(data, "individual_outputs/biomarker_strategy_enriched.json")
         
         print("\n🎉 Biomarker strategy cleaning pipeline completed!")
 
+_worker_cleaner = None
+
+def _init_profile_worker():
+    """Give each worker process its own cleaner instead of pickling the parent's"""
+    global _worker_cleaner
+    _worker_cleaner = BiomarkerStrategyCleaner()
+
+def _profile_strategy(strategy: str) -> Tuple:
+    """Profile one strategy in a worker process"""
+    return _worker_cleaner.profile_strategy(strategy)
+
 def main():
     """Main function"""
     cleaner = BiomarkerStrategyCleaner()
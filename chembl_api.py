@@ -0,0 +1,122 @@
+# chembl_api.py
+
+"""
+Thin client for the ChEMBL REST API shared by drug.py and payload_linker.py.
+
+All calls go through one pooled requests.Session, so connections are kept alive
+and reused across lookups (including from worker threads), at most
+MAX_IN_FLIGHT requests run at once, and throttling (429, honouring Retry-After) or
+server errors are retried with backoff. Successful responses, including empty
+search results, are kept in an on-disk cache shared by every stage, so reruns and
+later stages skip names already looked up (see load_cache / save_cache). The cache
+is rebuilt once it is CACHE_MAX_AGE_DAYS old, like the DOID maps cache in disease.py.
+"""
+
+import os
+import pickle
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CHEMBL_API_URL = "https://www.ebi.ac.uk/chembl/api/data"
+PAGE_LIMIT = 1000
+ID_CHUNK_SIZE = 200  # IDs per __in filter, keeping request URLs well under length limits
+REQUEST_TIMEOUT = 30
+MAX_IN_FLIGHT = 10  # ChEMBL throttles per IP, so cap concurrent requests across all worker threads
+CACHE_FILE = ".chembl_cache.pkl"
+CACHE_MAX_AGE_DAYS = 30
+
+# Molecule fields read by drug.py / payload_linker.py. Searches ask for them directly, and hits
+# that carry all of them skip the follow-up molecule fetch; False restores the search-then-fetch path
+MOLECULE_FIELDS = (
+    "molecule_chembl_id", "pref_name", "max_phase", "first_approval", "drug_type", "molecule_type",
+    "withdrawn_flag", "black_box_warning", "atc_classifications", "usan_stem", "indication_class",
+)
+SEARCH_WITH_DETAILS = True
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                      respect_retry_after_header=True)
+))
+in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+
+# (path, sorted params) -> decoded response body; only successful responses are stored
+response_cache = {}
+# When the oldest entry in response_cache was fetched; kept as CACHE_FILE's mtime
+cache_created = time.time()
+
+
+def load_cache(use_existing=True):
+    """
+    Load persisted responses from CACHE_FILE unless it is CACHE_MAX_AGE_DAYS old;
+    pass use_existing=False to rebuild from scratch.
+    """
+    global cache_created
+    response_cache.clear()
+    cache_created = time.time()
+    if (use_existing and os.path.exists(CACHE_FILE)
+            and cache_created - os.path.getmtime(CACHE_FILE) < CACHE_MAX_AGE_DAYS * 86400):
+        with open(CACHE_FILE, "rb") as f:
+            response_cache.update(pickle.load(f))
+        cache_created = os.path.getmtime(CACHE_FILE)
+
+
+def save_cache():
+    with open(CACHE_FILE, "wb") as f:
+        pickle.dump(response_cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Rewriting must not make old entries look fresh, so the age keeps counting from cache_created
+    os.utime(CACHE_FILE, (cache_created, cache_created))
+
+
+def get_json(path, **params):
+    """GET a ChEMBL endpoint (path without the .json suffix) and return the decoded body"""
+    key = (path, tuple(sorted(params.items())))
+    if key in response_cache:
+        return response_cache[key]
+    with in_flight:
+        response = session.get(f"{CHEMBL_API_URL}/{path}.json", params=params, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    body = response_cache[key] = response.json()
+    return body
+
+
+def search_molecules(query):
+    """Molecule records matching a free-text query, best match first"""
+    # ChEMBL search ignores case and surrounding whitespace; normalizing the query lets every
+    # stage sharing CACHE_FILE reuse one cached response per name
+    query = query.strip().lower()
+    if SEARCH_WITH_DETAILS:
+        return get_json("molecule/search", q=query, only=",".join(MOLECULE_FIELDS)).get("molecules", [])
+    return get_json("molecule/search", q=query).get("molecules", [])
+
+
+def has_molecule_details(record):
+    """True if a search hit already carries every MOLECULE_FIELDS entry, so its molecule record need not be fetched"""
+    return SEARCH_WITH_DETAILS and all(field in record for field in MOLECULE_FIELDS)
+
+
+def filter_records(resource, key, **filters):
+    """Every record of a list endpoint (e.g. "mechanism" / "mechanisms") matching filters, across pages"""
+    records = []
+    params = dict(filters, limit=PAGE_LIMIT, offset=0)
+    while True:
+        page = get_json(resource, **params)
+        records.extend(page.get(key, []))
+        if not page.get("page_meta", {}).get("next"):
+            return records
+        params["offset"] += PAGE_LIMIT
+
+
+def filter_records_in(resource, key, id_field, ids):
+    """Records of a list endpoint for many IDs at once through the {id_field}__in filter"""
+    ids = sorted(ids)
+    records = []
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        records.extend(filter_records(resource, key, **{f"{id_field}__in": ",".join(ids[start:start + ID_CHUNK_SIZE])}))
+    return records
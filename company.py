@@ -7,12 +7,18 @@ It includes logic to extract company names from alphanumeric drug labels
 when the company field is unknown.
 """
 
-import json
+import orjson
 import re
+import sys
 from pathlib import Path
 from collections import defaultdict, Counter
+from functools import lru_cache
 import requests
 from typing import Dict, List, Optional, Tuple
+from pipeline_utils import build_variation_automaton, match_partial_variation, write_json_array
+
+# Fields kept per drug in the minimal individual output
+MINIMAL_DRUG_FIELDS = ("drugName", "companyCleaned", "companyOriginal", "companyConfidence")
 
 class CompanyCleaner:
     def __init__(self):
@@ -20,63 +26,22 @@ class CompanyCleaner:
         self.known_companies = set()
         self.drug_to_company_mapping = {}
         
-    def load_data(self, file_path: str) -> List[Dict]:
-        """Load the input JSON data"""
-        with open(file_path, 'r') as f:
-            return json.load(f)
-    
-    def save_data(self, data: List[Dict], file_path: str):
-        """Save the enriched data"""
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2)
-    
-    def extract_company_from_drug_name(self, drug_name: str) -> Optional[str]:
-        """
-        Extract potential company name from alphanumeric drug labels.
-        Common patterns: [Company][Number] or [Company][Letter][Number]
-        """
-        if not drug_name or drug_name == "unknown":
-            return None
-            
+        # Alphanumeric drug code patterns: [Letters][Numbers] or [Letters][Letter][Numbers]
+        self.drug_code_patterns = [
+            re.compile(r'^([A-Z]{2,4})\d+'),  # 2-4 letters followed by numbers
+            re.compile(r'^([A-Z]{2,4})[A-Z]\d+'),  # 2-4 letters, 1 letter, numbers
+        ]
+        
         # Common company prefixes that might be in drug names
-        company_prefixes = [
+        self.company_prefixes = [
             'ADC', 'ABT', 'AMG', 'BMS', 'GSK', 'JNJ', 'MRK', 'PFE', 'RHH', 'SNY',
             'AZ', 'RO', 'NVS', 'LLY', 'BMY', 'ABBV', 'TKY', 'DGN', 'IMD', 'GQ',
             'Affinity', 'MediLink', 'Heidelberg', 'ImmunoGen', 'Seattle', 'Genentech'
         ]
-        
-        # Look for company prefixes in drug name
-        for prefix in company_prefixes:
-            if drug_name.upper().startswith(prefix.upper()):
-                return prefix
-        
-        # Pattern matching for alphanumeric codes
-        # Look for patterns like: [Letters][Numbers] or [Letters][Letters][Numbers]
-        patterns = [
-            r'^([A-Z]{2,4})\d+',  # 2-4 letters followed by numbers
-            r'^([A-Z]{2,4})[A-Z]\d+',  # 2-4 letters, 1 letter, numbers
-        ]
-        
-        for pattern in patterns:
-            match = re.match(pattern, drug_name.upper())
-            if match:
-                potential_company = match.group(1)
-                # Check if this looks like a known company code
-                if len(potential_company) >= 2:
-                    return potential_company
-        
-        return None
-    
-    def clean_company_name(self, company_name: str) -> str:
-        """Clean and standardize company names"""
-        if not company_name or company_name == "unknown":
-            return "unknown"
-        
-        # Remove common suffixes and clean up
-        company = company_name.strip()
+        self.prefix_trie = self.build_prefix_trie(self.company_prefixes)
         
         # Common company name variations
-        company_variations = {
+        self.company_variations = {
             'affinity biopharma': 'Affinity Biopharma',
             'medilink': 'MediLink',
             'heidelberg pharma': 'Heidelberg Pharma',
@@ -110,98 +75,218 @@ class CompanyCleaner:
             'immunomedics': 'Immunomedics',
             'imd': 'Immunomedics'
         }
+        # Automaton over the variation keys for the partial-match fallback
+        self.company_variation_automaton = build_variation_automaton(self.company_variations)
+        self.company_variations_joined = "\n".join(self.company_variations)
+        
+        # Memoize the per-string helpers; the same names repeat across many drugs
+        self.clean_company_name = lru_cache(maxsize=None)(self.clean_company_name)
+        self.extract_company_from_drug_name = lru_cache(maxsize=None)(self.extract_company_from_drug_name)
+        
+    def load_data(self, file_path: str) -> List[Dict]:
+        """Load the input JSON data"""
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
+    
+    def save_data(self, data: List[Dict], file_path: str):
+        """Save the enriched data"""
+        with open(file_path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    
+    def save_minimal_output(self, data: List[Dict], file_path: str):
+        """Save the id and company fields of each entry, trimming entries as they are written"""
+        write_json_array((
+            {
+                "id": entry.get("id"),
+                "extractedDrugs": [
+                    {field: drug.get(field) for field in MINIMAL_DRUG_FIELDS}
+                    for drug in entry.get("extractedDrugs", [])
+                ]
+            }
+            for entry in data
+        ), file_path)
+    
+    def build_prefix_trie(self, prefixes: List[str]) -> Dict:
+        """
+        Build a character trie over the uppercased prefixes.
+        Terminal nodes store (list position, original prefix) under the None key.
+        """
+        trie = {}
+        for position, prefix in enumerate(prefixes):
+            node = trie
+            for char in prefix.upper():
+                node = node.setdefault(char, {})
+            node.setdefault(None, (position, prefix))
+        return trie
+    
+    def match_company_prefix(self, name_upper: str) -> Optional[str]:
+        """Return the earliest-listed company prefix that starts the uppercased name"""
+        best = None
+        node = self.prefix_trie
+        for char in name_upper:
+            node = node.get(char)
+            if node is None:
+                break
+            terminal = node.get(None)
+            if terminal is not None and (best is None or terminal < best):
+                best = terminal
+        return best[1] if best else None
+    
+    def extract_company_from_drug_name(self, drug_name: str) -> Optional[str]:
+        """
+        Extract potential company name from alphanumeric drug labels.
+        Common patterns: [Company][Number] or [Company][Letter][Number]
+        """
+        if not drug_name or drug_name == "unknown":
+            return None
+            
+        name_upper = drug_name.upper()
+        
+        # Look for company prefixes in drug name
+        prefix = self.match_company_prefix(name_upper)
+        if prefix:
+            return prefix
+        
+        # Pattern matching for alphanumeric codes
+        for pattern in self.drug_code_patterns:
+            match = pattern.match(name_upper)
+            if match:
+                potential_company = match.group(1)
+                # Check if this looks like a known company code
+                if len(potential_company) >= 2:
+                    return potential_company
+        
+        return None
+    
+    def clean_company_name(self, company_name: str) -> str:
+        """Clean and standardize company names"""
+        if not company_name or company_name == "unknown":
+            return "unknown"
+        
+        # Remove common suffixes and clean up
+        company = company_name.strip()
         
-        # Check for exact matches in variations
         lower_company = company.lower()
-        for variation, standard in company_variations.items():
-            if lower_company == variation:
-                return standard
+        
+        # Check for exact matches in variations
+        standard = self.company_variations.get(lower_company)
+        if standard is not None:
+            return standard
         
         # Check for partial matches
-        for variation, standard in company_variations.items():
-            if variation in lower_company or lower_company in variation:
-                return standard
+        standard = match_partial_variation(
+            lower_company, self.company_variations, self.company_variation_automaton, self.company_variations_joined
+        )
+        if standard is not None:
+            return standard
         
         # If no match found, return the cleaned original
         return company.title()
     
-    def build_company_dictionary(self, data: List[Dict]) -> Dict:
-        """Build a dictionary of all unique company names and their frequencies"""
+    def resolve_company(self, company_name: str, drug_name: str) -> Tuple[str, bool]:
+        """
+        Clean a company name, falling back to the drug label when it is unknown.
+        Returns the cleaned company and whether it was extracted from the drug name.
+        """
+        cleaned_company = self.clean_company_name(company_name)
+        
+        # If still unknown, try to extract from drug name
+        if cleaned_company == "unknown" and drug_name:
+            extracted_company = self.extract_company_from_drug_name(drug_name)
+            if extracted_company:
+                return sys.intern(extracted_company), True
+        
+        # Interned so every drug and dictionary key shares one copy of each company name
+        return sys.intern(cleaned_company), False
+    
+    def tally_companies(self, pair_multiplicity: Counter, resolved: Dict[Tuple[str, str], Tuple[str, bool]]) -> Dict[str, int]:
+        """
+        Count drugs per cleaned company from the number of drugs per distinct
+        (company, drug name) pair and its resolution; shared by enrich_data and
+        build_company_dictionary.
+        """
         company_counts = Counter()
-        drug_company_mapping = {}
-        
-        for entry in data:
-            for drug in entry.get("extractedDrugs", []):
-                company = drug.get("company", "unknown")
-                drug_name = drug.get("drugName", "")
-                
-                # Clean the company name
-                cleaned_company = self.clean_company_name(company)
-                
-                # If company is unknown, try to extract from drug name
-                if cleaned_company == "unknown" and drug_name:
-                    extracted_company = self.extract_company_from_drug_name(drug_name)
-                    if extracted_company:
-                        cleaned_company = extracted_company
-                        drug_company_mapping[drug_name] = extracted_company
-                
-                if cleaned_company != "unknown":
-                    company_counts[cleaned_company] += 1
-                    self.known_companies.add(cleaned_company)
-                
-                # Store the mapping for later use
-                drug_company_mapping[drug_name] = cleaned_company
-        
-        self.drug_to_company_mapping = drug_company_mapping
+        for pair, drug_count in pair_multiplicity.items():
+            cleaned_company, _ = resolved[pair]
+            if cleaned_company != "unknown":
+                company_counts[cleaned_company] += drug_count
+                self.known_companies.add(cleaned_company)
         return dict(company_counts)
     
+    def build_company_dictionary(self, data: List[Dict]) -> Dict:
+        """Build a dictionary of all unique company names and their frequencies"""
+        drug_pairs = [
+            (drug.get("company", "unknown"), drug.get("drugName", ""))
+            for entry in data
+            for drug in entry.get("extractedDrugs", [])
+        ]
+        pair_multiplicity = Counter(drug_pairs)
+        resolved = {pair: self.resolve_company(*pair) for pair in pair_multiplicity}
+        
+        # Later drugs win when a drug name appears with several companies
+        self.drug_to_company_mapping = {drug_name: resolved[company, drug_name][0] for company, drug_name in drug_pairs}
+        return self.tally_companies(pair_multiplicity, resolved)
+    
     def enrich_data(self, data: List[Dict]) -> List[Dict]:
         """Enrich the data with cleaned company names and additional metadata"""
         print("🏢 Enriching company data...")
         
-        enriched_count = 0
-        unknown_count = 0
-        
-        for entry in data:
-            for drug in entry.get("extractedDrugs", []):
-                original_company = drug.get("company", "unknown")
-                drug_name = drug.get("drugName", "")
-                
-                # Clean the company name
-                cleaned_company = self.clean_company_name(original_company)
-                
-                # If still unknown, try to extract from drug name
-                if cleaned_company == "unknown" and drug_name:
-                    extracted_company = self.extract_company_from_drug_name(drug_name)
-                    if extracted_company:
-                        cleaned_company = extracted_company
-                        enriched_count += 1
-                
-                # Add enriched fields
-                drug["companyCleaned"] = cleaned_company
-                drug["companyOriginal"] = original_company
-                drug["companyConfidence"] = 1 if cleaned_company != "unknown" else 0
-                
-                if cleaned_company == "unknown":
-                    unknown_count += 1
-                else:
-                    enriched_count += 1
+        # Count drugs per distinct (company, drug name) pair (in first-seen order), then
+        # resolve each pair once; the per-drug loop only looks results up
+        drugs = [drug for entry in data for drug in entry.get("extractedDrugs", [])]
+        drug_pairs = [(drug.get("company", "unknown"), drug.get("drugName", "")) for drug in drugs]
+        pair_multiplicity = Counter(drug_pairs)
+        resolved = {pair: self.resolve_company(*pair) for pair in pair_multiplicity}
+        
+        # Lay out the enriched fields once per distinct pair, then broadcast them
+        # to every drug with a single dict.update
+        enriched_fields = {}
+        for (original_company, drug_name), (cleaned_company, _) in resolved.items():
+            enriched_fields[(original_company, drug_name)] = {
+                "companyCleaned": cleaned_company,
+                "companyOriginal": original_company,
+                "companyConfidence": 1 if cleaned_company != "unknown" else 0
+            }
+        
+        fields_for = enriched_fields.__getitem__
+        for drug, pair in zip(drugs, drug_pairs):
+            drug.update(fields_for(pair))
+        
+        # Build the company dictionary from the per-pair drug counts. The drug-to-company
+        # mapping is not kept here; run_pipeline collects it from the enriched records
+        self.company_dictionary = self.tally_companies(pair_multiplicity, resolved)
+        known_count = sum(self.company_dictionary.values())
+        unknown_count = len(drugs) - known_count
+        # Names taken from the drug label count twice, as they always have
+        enriched_count = known_count + sum(
+            drug_count for pair, drug_count in pair_multiplicity.items() if resolved[pair][1]
+        )
         
         print(f"   ✅ Enriched {enriched_count} company names")
         print(f"   ⚠️  {unknown_count} companies remain unknown")
         
         return data
     
+    def collect_drug_company_mapping(self, data: List[Dict]) -> Dict[str, str]:
+        """Map each drug name to its cleaned company, read from already enriched records"""
+        return {
+            drug.get("drugName", ""): drug["companyCleaned"]
+            for entry in data
+            for drug in entry.get("extractedDrugs", [])
+        }
+    
     def generate_company_dictionary(self, data: List[Dict]) -> Dict:
         """Generate a comprehensive company dictionary"""
         company_dict = self.build_company_dictionary(data)
-        
-        # Add metadata
+        return self.format_company_dictionary(company_dict, self.drug_to_company_mapping)
+    
+    def format_company_dictionary(self, company_dict: Dict[str, int], drug_company_mapping: Dict[str, str]) -> Dict:
+        """Add metadata to company counts, e.g. those enrich_data left in self.company_dictionary"""
         dictionary = {
             "metadata": {
                 "total_companies": len(company_dict),
                 "known_companies": list(self.known_companies),
-                "drug_to_company_mapping": self.drug_to_company_mapping
+                "drug_to_company_mapping": drug_company_mapping
             },
             "companies": company_dict
         }
@@ -218,9 +303,9 @@ class CompanyCleaner:
         data = self.load_data(input_file)
         print(f"   ✅ Loaded {len(data)} entries")
         
-        # Build company dictionary
-        print("📊 Building company dictionary...")
-        company_dict = self.build_company_dictionary(data)
+        # Enrich data, building the company dictionary in the same pass
+        enriched_data = self.enrich_data(data)
+        company_dict = self.company_dictionary
         print(f"   ✅ Found {len(company_dict)} unique companies")
         
         # Show top companies
@@ -228,25 +313,9 @@ class CompanyCleaner:
         for company, count in sorted(company_dict.items(), key=lambda x: x[1], reverse=True)[:10]:
             print(f"   • {company}: {count} drugs")
         
-        # Enrich data
-        enriched_data = self.enrich_data(data)
-        
         # Save minimal individual output for unified pipeline debugging
         Path("individual_outputs").mkdir(parents=True, exist_ok=True)
-        minimal_output = []
-        for entry in data:
-            minimal_entry = {"id": entry.get("id"), "extractedDrugs": []}
-            for drug in entry.get("extractedDrugs", []):
-                minimal_drug = {
-                    "drugName": drug.get("drugName"),
-                    "companyCleaned": drug.get("companyCleaned"),
-                    "companyOriginal": drug.get("companyOriginal"),
-                    "companyConfidence": drug.get("companyConfidence")
-                }
-                minimal_entry["extractedDrugs"].append(minimal_drug)
-            minimal_output.append(minimal_entry)
-        with open("individual_outputs/company_enriched.json", "w") as f:
-            json.dump(minimal_output, f, indent=2)
+        self.save_minimal_output(data, "individual_outputs/company_enriched.json")
         
         # Save enriched data (only if explicitly requested)
         if output_file != "aacrArticle_company_enriched.json":
@@ -261,9 +330,10 @@ class CompanyCleaner:
         dict_file = "dictionaries/company/company_dictionary.json"
         Path("dictionaries/company").mkdir(parents=True, exist_ok=True)
         
-        full_dict = self.generate_company_dictionary(data)
-        with open(dict_file, 'w') as f:
-            json.dump(full_dict, f, indent=2)
+        # enrich_data already counted this data, so format those counts instead of rebuilding them
+        full_dict = self.format_company_dictionary(company_dict, self.collect_drug_company_mapping(data))
+        with open(dict_file, 'wb') as f:
+            f.write(orjson.dumps(full_dict, option=orjson.OPT_INDENT_2))
         
         print(f"   ✅ Company dictionary saved to {dict_file}")
         
@@ -1,60 +1,151 @@
-from owlready2 import get_ontology, ThingClass
 from collections import defaultdict
-import json
+import orjson
+import os
+import pickle
+import time
+import numpy as np
 
 ONTOLOGY_URL = "https://raw.githubusercontent.com/DiseaseOntology/HumanDiseaseOntology/master/src/ontology/doid.owl"
 CANCER_ROOT = "DOID:162"
 CELLULAR_PROLIF_ROOT = "DOID:14566"
 ORGAN_SYSTEM_CANCER = "DOID:0050686"
+# A path qualifies only if it passes through all three roots; track that as a bitmask per path
+ROOT_BITS = {CANCER_ROOT: 1, CELLULAR_PROLIF_ROOT: 2, ORGAN_SYSTEM_CANCER: 4}
+ALL_ROOTS_MASK = 7
 
-print("🔄 Loading ontology...")
-onto = get_ontology(ONTOLOGY_URL).load()
+# The parsed label/parent/child maps are cached here so reruns skip the OWL download and parse
+MAPS_CACHE_FILE = "dictionaries/disease/_doid_maps.pkl"
+MAPS_CACHE_MAX_AGE_DAYS = 30
 
-label_map = {}
-parent_map = defaultdict(list)
-child_map = defaultdict(list)
+def index_ontology():
+    """Download and parse DOID, returning (label_map, parent_map, child_map)"""
+    from owlready2 import get_ontology, ThingClass
 
-print("🔍 Indexing ontology...")
-for cls in onto.classes():
-    if "DOID_" not in cls.name:
-        continue
-    curie = "DOID:" + cls.name.split("_")[-1]
-    label_map[curie] = cls.label.first() or cls.name
+    print("🔄 Loading ontology...")
+    onto = get_ontology(ONTOLOGY_URL).load()
+
+    label_map = {}
+    parent_map = defaultdict(list)
+    child_map = defaultdict(list)
 
-    for parent in cls.is_a:
-        if isinstance(parent, ThingClass) and hasattr(parent, "name") and "DOID_" in parent.name:
-            parent_curie = "DOID:" + parent.name.split("_")[-1]
+    print("🔍 Indexing ontology...")
+    # Two bulk SPARQL queries (labels, then subclass edges) replace probing .label and
+    # .is_a on every class object, which hits the quadstore once per class and attribute
+    for cls, label in onto.world.sparql("""
+        SELECT ?c ?l WHERE {
+            ?c a owl:Class .
+            OPTIONAL { ?c rdfs:label ?l }
+        }
+    """):
+        if not isinstance(cls, ThingClass) or "DOID_" not in cls.name:
+            continue
+        curie = "DOID:" + cls.name.rsplit("_", 1)[-1]
+        # Keep the first label seen, falling back to the class name
+        if not label_map.get(curie):
+            label_map[curie] = label or cls.name
+
+    for cls, parent in onto.world.sparql("""
+        SELECT ?c ?p WHERE {
+            ?c a owl:Class .
+            ?c rdfs:subClassOf ?p .
+        }
+    """):
+        if not isinstance(cls, ThingClass) or "DOID_" not in cls.name:
+            continue
+        if isinstance(parent, ThingClass) and "DOID_" in parent.name:
+            curie = "DOID:" + cls.name.rsplit("_", 1)[-1]
+            parent_curie = "DOID:" + parent.name.rsplit("_", 1)[-1]
             parent_map[curie].append(parent_curie)
             child_map[parent_curie].append(curie)
 
-# ✅ Step: Recursive path tracing
-def trace_paths_to_root(curie, path=None):
-    path = [curie] + (path or [])
-    parents = parent_map.get(curie, [])
-    if not parents:
-        return [path]
-    paths = []
-    for p in parents:
-        paths.extend(trace_paths_to_root(p, path))
-    return paths
-
-# ✅ Step: Find leaf nodes (no children)
-print("🌿 Finding leaf nodes in cancer subtree...")
-leaf_nodes = []
-for curie in label_map:
-    # is leaf and in cancer lineage
-    if curie not in child_map:
-        paths = trace_paths_to_root(curie)
-        if any(CANCER_ROOT in p and CELLULAR_PROLIF_ROOT in p and ORGAN_SYSTEM_CANCER in p for p in paths):
-            leaf_nodes.append(curie)
+    return label_map, dict(parent_map), dict(child_map)
+
+def load_ontology_maps():
+    """Load the DOID maps from the local cache when it is fresh, otherwise rebuild and cache them"""
+    if os.path.exists(MAPS_CACHE_FILE) and time.time() - os.path.getmtime(MAPS_CACHE_FILE) < MAPS_CACHE_MAX_AGE_DAYS * 86400:
+        print(f"📦 Loading cached ontology maps from {MAPS_CACHE_FILE}...")
+        with open(MAPS_CACHE_FILE, "rb") as f:
+            return pickle.load(f)
+
+    maps = index_ontology()
+    os.makedirs(os.path.dirname(MAPS_CACHE_FILE), exist_ok=True)
+    with open(MAPS_CACHE_FILE, "wb") as f:
+        pickle.dump(maps, f, protocol=5)
+    return maps
+
+label_map, parent_map, child_map = load_ontology_maps()
+
+# ✅ Step: Memoized path tracing
+# Each node's root paths are built once from its parents' cached paths, so shared
+# upper lineages are walked a single time for the whole run
+paths_cache = {}
 
-print(f"🌿 Found {len(leaf_nodes)} cancer leaf terms")
+def trace_paths_to_root(curie):
+    """Return (path, root_mask) for every path from a root down to curie; paths are tuples ordered
+    root -> curie and root_mask ORs the ROOT_BITS of the required roots on the path"""
+    stack = [curie]
+    while stack:
+        node = stack[-1]
+        if node in paths_cache:
+            stack.pop()
+            continue
+        parents = parent_map.get(node, [])
+        pending = [p for p in parents if p not in paths_cache]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        bit = ROOT_BITS.get(node, 0)
+        if parents:
+            paths_cache[node] = [(path + (node,), mask | bit) for p in parents for path, mask in paths_cache[p]]
+        else:
+            paths_cache[node] = [((node,), bit)]
+    return paths_cache[curie]
 
-# ✅ Step: Construct dictionary from leaves
+# ✅ Step: Integer-encode the DAG so subtree membership is a vectorized BFS over CSR arrays
+idx2id = list(dict.fromkeys([*label_map, *parent_map, *child_map]))
+id2idx = {curie: i for i, curie in enumerate(idx2id)}
+
+def build_csr(adjacency):
+    """Flatten a curie -> [curie] map into int32 CSR (indptr, indices) arrays over idx2id"""
+    indptr = np.zeros(len(idx2id) + 1, dtype=np.int32)
+    indices = []
+    for i, curie in enumerate(idx2id):
+        neighbours = adjacency.get(curie, [])
+        indices.extend(id2idx[n] for n in neighbours)
+        indptr[i + 1] = indptr[i] + len(neighbours)
+    return indptr, np.array(indices, dtype=np.int32)
+
+child_indptr, child_indices = build_csr(child_map)
+
+def subtree_mask(root):
+    """Boolean mask of root and every node below it, expanding one BFS frontier at a time"""
+    reached = np.zeros(len(idx2id), dtype=bool)
+    if root not in id2idx:
+        return reached
+    frontier = np.array([id2idx[root]], dtype=np.int32)
+    while frontier.size:
+        reached[frontier] = True
+        starts = child_indptr[frontier]
+        counts = child_indptr[frontier + 1] - starts
+        # Gather every child slice of the frontier in one shot
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        children = child_indices[offsets]
+        frontier = np.unique(children[~reached[children]])
+    return reached
+
+# A cancer leaf has no children and sits under all three roots; only those need their paths traced
+is_leaf = child_indptr[1:] == child_indptr[:-1]
+candidate_mask = is_leaf & subtree_mask(CANCER_ROOT) & subtree_mask(CELLULAR_PROLIF_ROOT) & subtree_mask(ORGAN_SYSTEM_CANCER)
+candidate_leaves = {idx2id[i] for i in np.flatnonzero(candidate_mask)}
+
+# ✅ Step: Build the dictionary from the candidate leaves' root paths
+print("🌿 Finding leaf nodes in cancer subtree...")
 leaf_hierarchy = {}
-for curie in leaf_nodes:
-    paths = trace_paths_to_root(curie)
-    paths = [p for p in paths if CANCER_ROOT in p and CELLULAR_PROLIF_ROOT in p and ORGAN_SYSTEM_CANCER in p]
+for curie in label_map:
+    if curie not in candidate_leaves:
+        continue
+    paths = [path for path, mask in trace_paths_to_root(curie) if mask == ALL_ROOTS_MASK]
     if not paths:
         continue
     label_paths = [[label_map.get(c, c) for c in path] for path in paths]
@@ -64,11 +155,12 @@ for curie in leaf_nodes:
         "label_paths_to_root": label_paths
     }
 
+print(f"🌿 Found {len(leaf_hierarchy)} cancer leaf terms")
+
 # ✅ Step: Save result
-import os
 os.makedirs("dictionaries/disease", exist_ok=True)
 output_file = "dictionaries/disease/doid_cancer_leaf_paths.json"
-with open(output_file, "w") as f:
-    json.dump(leaf_hierarchy, f, indent=2)
+with open(output_file, "wb") as f:
+    f.write(orjson.dumps(leaf_hierarchy, option=orjson.OPT_INDENT_2))
 
 print(f"✅ Saved {len(leaf_hierarchy)} leaf nodes to {output_file}")
\ No newline at end of file
@@ -10,13 +10,17 @@ This script enriches disease/cancer indication data with:
 - Comprehensive JSON enrichment
 """
 
-import json
+import orjson
 import re
-import difflib
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
+from functools import lru_cache
 from typing import Dict, List, Any, Optional, Tuple
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from rapidfuzz import process, fuzz
+from pipeline_utils import write_json_array
 
 # Configuration
 CONFIG = {
@@ -27,6 +31,39 @@ CONFIG = {
     "ACRONYM_CUTOFF": 0.60
 }
 
+# (term pattern, label keyword) pairs for the anatomical score boost, checked in order
+ANATOMY_BOOSTS = (
+    (re.compile(r"lung|pulmonary"), "lung"),
+    (re.compile(r"breast|mammary"), "breast"),
+    (re.compile(r"prostate"), "prostate"),
+    (re.compile(r"colon|colorectal|large intestine"), "colon"),
+)
+
+# (needle, replacement) pairs used to derive label synonyms
+SYNONYM_REPLACEMENTS = (
+    ("cancer", "carcinoma"),
+    ("carcinoma", "cancer"),
+    ("tumor", "cancer"),
+    ("cancer", "tumor"),
+    ("malignant", ""),
+    ("malignancy", ""),
+    # Add general terms
+    ("estrogen-receptor positive ", ""),
+    ("estrogen-receptor negative ", ""),
+    ("progesterone-receptor positive ", ""),
+    ("progesterone-receptor negative ", ""),
+    ("Her2-receptor positive ", ""),
+    ("Her2-receptor negative ", ""),
+    ("triple-receptor negative ", ""),
+    ("luminal ", ""),
+)
+TRAILING_LETTER_PATTERN = re.compile(r"\s[A-Z]$")
+
+# Fuzzy candidates kept per expanded term, and query rows scored per cdist call
+LABEL_MATCH_LIMIT = 10
+SYNONYM_MATCH_LIMIT = 5
+CDIST_BATCH_SIZE = 256
+
 # Common cancer acronyms and their expansions
 CANCER_ACRONYMS = {
     "NSCLC": "non-small cell lung cancer",
@@ -53,6 +90,37 @@ CANCER_ACRONYMS = {
     "B7-H3+": "B7-H3 positive"
 }
 
+# All acronyms in one alternation, longest first so "B-ALL" wins over "ALL"; the lookarounds act as
+# word boundaries that also hold next to "+"/"-", so "ALL" no longer fires inside "SMALL"
+ACRONYM_PATTERN = re.compile(
+    r"(?<!\w)(" + "|".join(map(re.escape, sorted(CANCER_ACRONYMS, key=len, reverse=True))) + r")(?!\w)"
+)
+
+def sort_choices_by_length(choices: List[Tuple[str, str]]) -> Tuple[List[str], List[str], List[int]]:
+    """Split (text, doid) pairs into parallel text, DOID and length lists ordered by text length"""
+    choices = sorted(choices, key=lambda choice: len(choice[0]))
+    return [text for text, _ in choices], [doid for _, doid in choices], [len(text) for text, _ in choices]
+
+def length_window(lengths: List[int], shortest: int, longest: int, cutoff: float) -> Tuple[int, int]:
+    """Slice bounds of the sorted lengths that can reach fuzz.ratio >= cutoff against terms of the given lengths.
+
+    fuzz.ratio is 2*LCS/(len_a + len_b) <= 2*min(len_a, len_b)/(len_a + len_b), so any
+    choice outside [shortest*c/(2-c), longest*(2-c)/c] scores below the cutoff.
+    """
+    lo = bisect_left(lengths, shortest * cutoff / (2 - cutoff) - 1e-9)
+    hi = bisect_right(lengths, longest * (2 - cutoff) / cutoff + 1e-9)
+    return lo, hi
+
+def top_k_scores(scores: np.ndarray, k: int, score_cutoff: float) -> List[Tuple[float, int]]:
+    """Return the k best (score, index) pairs of a cdist row, ordered like process.extract"""
+    candidates = np.flatnonzero(scores >= score_cutoff)
+    if len(candidates) > k:
+        # Partition to the k-th best score, keeping ties so the stable sort below breaks them by index
+        threshold = np.partition(scores[candidates], -k)[-k]
+        candidates = candidates[scores[candidates] >= threshold]
+    best = candidates[np.argsort(-scores[candidates], kind="stable")[:k]]
+    return [(float(scores[i]), int(i)) for i in best]
+
 class DiseaseEnricher:
     """Enhanced disease ontology enricher"""
     
@@ -60,18 +128,32 @@ class DiseaseEnricher:
         self.doid_hierarchy = {}
         self.doid_labels = {}
         self.doid_synonyms = {}
+        # Parallel length-sorted choice lists for RapidFuzz: match index -> DOID
+        self.label_doids = []
+        self.labels_lower = []
+        self.label_lengths = []
+        self.synonym_doids = []
+        self.synonyms_lower = []
+        self.synonym_lengths = []
+        # Lower-cased label or synonym -> [(doid, score)] in DOID order, for exact hits
+        self.exact_matches = defaultdict(list)
         self.expanded_terms = []
         self.fuzzy_matches = {}
         
+        # Per-instance memoization; the same indication recurs across many drugs
+        self.expand_acronyms = lru_cache(maxsize=None)(self.expand_acronyms)
+        
     def load_doid_hierarchy(self):
         """Load DOID hierarchy from disease.py output"""
         print("🔄 Loading DOID hierarchy...")
         
         try:
-            with open(CONFIG["DOID_HIERARCHY"], 'r') as f:
-                self.doid_hierarchy = json.load(f)
+            with open(CONFIG["DOID_HIERARCHY"], 'rb') as f:
+                self.doid_hierarchy = orjson.loads(f.read())
             
             # Create label and synonym mappings
+            label_choices = []
+            synonym_choices = []
             for doid, data in self.doid_hierarchy.items():
                 label = data.get("label", "")
                 self.doid_labels[doid] = label
@@ -80,6 +162,16 @@ class DiseaseEnricher:
                 synonyms = self.generate_synonyms(label)
                 self.doid_synonyms[doid] = synonyms
                 
+                self.exact_matches[label.lower()].append((doid, 1.0))
+                for synonym in synonyms:
+                    self.exact_matches[synonym].append((doid, 0.95))
+                
+                label_choices.append((label.lower(), doid))
+                synonym_choices.extend((synonym, doid) for synonym in synonyms)
+            
+            self.labels_lower, self.label_doids, self.label_lengths = sort_choices_by_length(label_choices)
+            self.synonyms_lower, self.synonym_doids, self.synonym_lengths = sort_choices_by_length(synonym_choices)
+            
             print(f"✅ Loaded {len(self.doid_hierarchy)} DOID terms")
             
         except FileNotFoundError:
@@ -90,166 +182,115 @@ class DiseaseEnricher:
     
     def generate_synonyms(self, label: str) -> List[str]:
         """Generate synonyms for a disease label"""
-        synonyms = [label.lower()]
-        
-        # Common variations
-        variations = [
-            label.replace("cancer", "carcinoma"),
-            label.replace("carcinoma", "cancer"),
-            label.replace("tumor", "cancer"),
-            label.replace("cancer", "tumor"),
-            label.replace("malignant", "").strip(),
-            label.replace("malignancy", "").strip(),
-            # Add general terms
-            label.replace("estrogen-receptor positive ", ""),
-            label.replace("estrogen-receptor negative ", ""),
-            label.replace("progesterone-receptor positive ", ""),
-            label.replace("progesterone-receptor negative ", ""),
-            label.replace("Her2-receptor positive ", ""),
-            label.replace("Her2-receptor negative ", ""),
-            label.replace("triple-receptor negative ", ""),
-            label.replace("luminal ", ""),
-            label.replace(" A", ""),
-            label.replace(" B", ""),
-            label.replace(" C", ""),
-            label.replace(" D", ""),
-            label.replace(" E", ""),
-            label.replace(" F", ""),
-            label.replace(" G", ""),
-            label.replace(" H", ""),
-            label.replace(" I", ""),
-            label.replace(" J", ""),
-            label.replace(" K", ""),
-            label.replace(" L", ""),
-            label.replace(" M", ""),
-            label.replace(" N", ""),
-            label.replace(" O", ""),
-            label.replace(" P", ""),
-            label.replace(" Q", ""),
-            label.replace(" R", ""),
-            label.replace(" S", ""),
-            label.replace(" T", ""),
-            label.replace(" U", ""),
-            label.replace(" V", ""),
-            label.replace(" W", ""),
-            label.replace(" X", ""),
-            label.replace(" Y", ""),
-            label.replace(" Z", ""),
-        ]
+        variations = [label.replace(needle, replacement) for needle, replacement in SYNONYM_REPLACEMENTS]
+        # Drop a trailing single-letter subtype ("... type A")
+        variations.append(TRAILING_LETTER_PATTERN.sub("", label))
         
-        for var in variations:
-            if var and var != label and len(var.strip()) > 0:
-                synonyms.append(var.lower().strip())
-        
-        return list(set(synonyms))
+        return list({var.lower().strip() for var in variations if var.strip()} | {label.lower()})
     
     def expand_acronyms(self, disease_term: str) -> List[str]:
         """Expand acronyms in disease terms"""
         expanded = [disease_term]
         
-        # Direct acronym matches
-        for acronym, expansion in CANCER_ACRONYMS.items():
-            if acronym.lower() in disease_term.lower():
-                expanded.append(disease_term.replace(acronym, expansion))
-                expanded.append(disease_term.replace(acronym, expansion).replace("(", "").replace(")", ""))
-        
-        # Handle complex terms with multiple acronyms
-        complex_term = disease_term
-        for acronym, expansion in CANCER_ACRONYMS.items():
-            if acronym in complex_term:
-                complex_term = complex_term.replace(acronym, expansion)
+        # One regex scan finds every acronym; expand each on its own, then all of them together
+        acronyms = list(dict.fromkeys(ACRONYM_PATTERN.findall(disease_term)))
+        for acronym in acronyms:
+            replaced = ACRONYM_PATTERN.sub(lambda m: CANCER_ACRONYMS[acronym] if m.group(1) == acronym else m.group(0), disease_term)
+            expanded.append(replaced)
+            expanded.append(replaced.replace("(", "").replace(")", ""))
         
-        if complex_term != disease_term:
-            expanded.append(complex_term)
+        if len(acronyms) > 1:
+            expanded.append(ACRONYM_PATTERN.sub(lambda m: CANCER_ACRONYMS[m.group(1)], disease_term))
         
-        return list(set(expanded))
+        return list(dict.fromkeys(expanded))
     
-    def fuzzy_match_disease(self, disease_term: str) -> List[Tuple[str, float, str]]:
-        """Fuzzy match disease term to DOID labels"""
+    def extract_fuzzy_hits(self, term_lower: str) -> Tuple[List[Tuple[float, int]], List[Tuple[float, int]]]:
+        """Score one term against DOID labels and synonyms with RapidFuzz"""
+        score_cutoff = CONFIG["FUZZY_CUTOFF"] * 100
+        # Only choices inside the length window can reach the cutoff, so score just that slice
+        label_lo, label_hi = length_window(self.label_lengths, len(term_lower), len(term_lower), CONFIG["FUZZY_CUTOFF"])
+        label_hits = process.extract(
+            term_lower,
+            self.labels_lower[label_lo:label_hi],
+            scorer=fuzz.ratio,
+            limit=LABEL_MATCH_LIMIT,
+            score_cutoff=score_cutoff
+        )
+        synonym_lo, synonym_hi = length_window(self.synonym_lengths, len(term_lower), len(term_lower), CONFIG["FUZZY_CUTOFF"])
+        synonym_hits = process.extract(
+            term_lower,
+            self.synonyms_lower[synonym_lo:synonym_hi],
+            scorer=fuzz.ratio,
+            limit=SYNONYM_MATCH_LIMIT,
+            score_cutoff=score_cutoff
+        )
+        return ([(score, label_lo + index) for _, score, index in label_hits],
+                [(score, synonym_lo + index) for _, score, index in synonym_hits])
+    
+    def batch_fuzzy_hits(self, terms: List[str]) -> Dict[str, Tuple[List[Tuple[float, int]], List[Tuple[float, int]]]]:
+        """Score all lower-cased terms at once with process.cdist, keeping extract's top-k per term"""
+        score_cutoff = CONFIG["FUZZY_CUTOFF"] * 100
+        hits = {}
+        # Batching terms by length keeps each batch's length window, and so its cdist matrix, narrow
+        terms = sorted(terms, key=len)
+        for start in range(0, len(terms), CDIST_BATCH_SIZE):
+            batch = terms[start:start + CDIST_BATCH_SIZE]
+            shortest, longest = len(batch[0]), len(batch[-1])
+            label_lo, label_hi = length_window(self.label_lengths, shortest, longest, CONFIG["FUZZY_CUTOFF"])
+            synonym_lo, synonym_hi = length_window(self.synonym_lengths, shortest, longest, CONFIG["FUZZY_CUTOFF"])
+            label_scores = process.cdist(batch, self.labels_lower[label_lo:label_hi], scorer=fuzz.ratio,
+                                         score_cutoff=score_cutoff, dtype=np.float64, workers=-1)
+            synonym_scores = process.cdist(batch, self.synonyms_lower[synonym_lo:synonym_hi], scorer=fuzz.ratio,
+                                           score_cutoff=score_cutoff, dtype=np.float64, workers=-1)
+            for row, term in enumerate(batch):
+                hits[term] = (
+                    [(score, label_lo + index)
+                     for score, index in top_k_scores(label_scores[row], LABEL_MATCH_LIMIT, score_cutoff)],
+                    [(score, synonym_lo + index)
+                     for score, index in top_k_scores(synonym_scores[row], SYNONYM_MATCH_LIMIT, score_cutoff)]
+                )
+        return hits
+    
+    def boost_anatomical_score(self, score: float, term_lower: str, label_lower: str) -> float:
+        """Boost score when term and label name the same site; the first matching site wins"""
+        for term_pattern, label_keyword in ANATOMY_BOOSTS:
+            if label_keyword in label_lower and term_pattern.search(term_lower):
+                return min(1.0, score + 0.15)
+        return score
+    
+    def fuzzy_match_disease(self, disease_term: str, fuzzy_hits: Optional[Dict] = None) -> List[Tuple[str, float, str]]:
+        """Fuzzy match disease term to DOID labels, using batch_fuzzy_hits results when given"""
         matches = []
         
         # Expand acronyms first
         expanded_terms = self.expand_acronyms(disease_term)
         
         for term in expanded_terms:
-            # Direct label matches
-            for doid, label in self.doid_labels.items():
-                if label.lower() == term.lower():
-                    matches.append((doid, 1.0, label))
-                
-                # Synonym matches
-                if doid in self.doid_synonyms:
-                    for synonym in self.doid_synonyms[doid]:
-                        if synonym == term.lower():
-                            matches.append((doid, 0.95, label))
+            # Direct label and synonym matches
+            for doid, score in self.exact_matches.get(term.lower(), ()):
+                matches.append((doid, score, self.doid_labels[doid]))
             
-            # Fuzzy matches
-            all_labels = list(self.doid_labels.values())
-            fuzzy_matches = difflib.get_close_matches(
-                term.lower(), 
-                [label.lower() for label in all_labels], 
-                n=10,  # Increased to get more candidates
-                cutoff=CONFIG["FUZZY_CUTOFF"]
-            )
+            # Fuzzy matches, as (score, index) pairs whose index maps straight to the DOID
+            term_lower = term.lower()
+            if fuzzy_hits is not None:
+                label_hits, synonym_hits = fuzzy_hits[term_lower]
+            else:
+                label_hits, synonym_hits = self.extract_fuzzy_hits(term_lower)
             
-            for match in fuzzy_matches:
-                # Find the DOID for this label
-                for doid, label in self.doid_labels.items():
-                    if label.lower() == match:
-                        score = difflib.SequenceMatcher(None, term.lower(), match).ratio()
-                        
-                        # Boost score for anatomical matches
-                        boosted_score = score
-                        # Check for lung cancer matches
-                        if any(lung_term in term.lower() for lung_term in ["lung", "pulmonary", "non-small cell lung", "small cell lung"]) and "lung" in label.lower():
-                            boosted_score = min(1.0, score + 0.15)
-                        # Check for breast cancer matches
-                        elif any(breast_term in term.lower() for breast_term in ["breast", "mammary"]) and "breast" in label.lower():
-                            boosted_score = min(1.0, score + 0.15)
-                        # Check for prostate cancer matches
-                        elif "prostate" in term.lower() and "prostate" in label.lower():
-                            boosted_score = min(1.0, score + 0.15)
-                        # Check for colon cancer matches
-                        elif any(colon_term in term.lower() for colon_term in ["colon", "colorectal", "large intestine"]) and "colon" in label.lower():
-                            boosted_score = min(1.0, score + 0.15)
-                        
-                        matches.append((doid, boosted_score, label))
+            for score, index in label_hits:
+                doid = self.label_doids[index]
+                label = self.doid_labels[doid]
+                score /= 100
+                
+                matches.append((doid, self.boost_anatomical_score(score, term_lower, label.lower()), label))
             
             # Also try matching against synonyms
-            all_synonyms = []
-            for doid, synonyms in self.doid_synonyms.items():
-                for synonym in synonyms:
-                    all_synonyms.append((doid, synonym))
-            
-            synonym_matches = difflib.get_close_matches(
-                term.lower(),
-                [synonym for _, synonym in all_synonyms],
-                n=5,  # Increased to get more candidates
-                cutoff=CONFIG["FUZZY_CUTOFF"]
-            )
-            
-            for match in synonym_matches:
-                for doid, synonym in all_synonyms:
-                    if synonym == match:
-                        score = difflib.SequenceMatcher(None, term.lower(), match).ratio()
-                        label = self.doid_labels.get(doid, "")
-                        
-                        # Boost score for anatomical matches
-                        boosted_score = score
-                        # Check for lung cancer matches
-                        if any(lung_term in term.lower() for lung_term in ["lung", "pulmonary", "non-small cell lung", "small cell lung"]) and "lung" in label.lower():
-                            boosted_score = min(1.0, score + 0.15)
-                        # Check for breast cancer matches
-                        elif any(breast_term in term.lower() for breast_term in ["breast", "mammary"]) and "breast" in label.lower():
-                            boosted_score = min(1.0, score + 0.15)
-                        # Check for prostate cancer matches
-                        elif "prostate" in term.lower() and "prostate" in label.lower():
-                            boosted_score = min(1.0, score + 0.15)
-                        # Check for colon cancer matches
-                        elif any(colon_term in term.lower() for colon_term in ["colon", "colorectal", "large intestine"]) and "colon" in label.lower():
-                            boosted_score = min(1.0, score + 0.15)
-                        
-                        matches.append((doid, boosted_score, label))
+            for score, index in synonym_hits:
+                doid = self.synonym_doids[index]
+                label = self.doid_labels.get(doid, "")
+                score /= 100
+                
+                matches.append((doid, self.boost_anatomical_score(score, term_lower, label.lower()), label))
         
         # Remove duplicates and sort by score
         unique_matches = {}
@@ -281,12 +322,17 @@ class DiseaseEnricher:
         
         print(f"📊 Found {len(all_diseases)} unique disease terms")
         
+        # Match each stripped term once; the lookup below is keyed the same way
+        unique_terms = {disease.strip() for disease in all_diseases if disease and disease.strip()}
+        
+        # Score every expanded term against the whole DOID vocabulary in one batch
+        queries = {term.lower() for disease in unique_terms for term in self.expand_acronyms(disease)}
+        fuzzy_hits = self.batch_fuzzy_hits(sorted(queries))
+        
         # Pre-compute disease matches
         disease_matches = {}
-        for disease in tqdm(all_diseases, desc="Matching diseases"):
-            if disease and disease.strip():
-                matches = self.fuzzy_match_disease(disease.strip())
-                disease_matches[disease] = matches
+        for disease in tqdm(unique_terms, desc="Matching diseases"):
+            disease_matches[disease] = self.fuzzy_match_disease(disease, fuzzy_hits)
         
         # Enrich the data
         for entry in data:
@@ -305,6 +351,7 @@ class DiseaseEnricher:
                         continue
                     
                     matches = disease_matches.get(disease.strip(), [])
+                    expanded_terms = self.expand_acronyms(disease)
                     if matches:
                         best_match = matches[0]
                         doid, score, label = best_match
@@ -319,7 +366,7 @@ class DiseaseEnricher:
                             "match_score": score,
                             "match_status": self.get_match_status(score),
                             "hierarchy_paths": paths,
-                            "expanded_terms": self.expand_acronyms(disease)
+                            "expanded_terms": expanded_terms
                         }
                         
                         enriched_diseases.append(enriched_disease)
@@ -332,7 +379,7 @@ class DiseaseEnricher:
                             "match_score": 0.0,
                             "match_status": "unknown",
                             "hierarchy_paths": [],
-                            "expanded_terms": self.expand_acronyms(disease)
+                            "expanded_terms": expanded_terms
                         }
                         enriched_diseases.append(enriched_disease)
                 
@@ -391,8 +438,8 @@ def main():
     
     # Load input data
     print("📥 Loading input data...")
-    with open(CONFIG["INPUT_JSON"], 'r') as f:
-        data = json.load(f)
+    with open(CONFIG["INPUT_JSON"], 'rb') as f:
+        data = orjson.loads(f.read())
     
     print(f"✅ Loaded {len(data)} entries")
     
@@ -406,8 +453,7 @@ def main():
     print("💾 Saving enriched data...")
     import os
     os.makedirs("dictionaries/disease", exist_ok=True)
-    with open(CONFIG["OUTPUT_JSON"], 'w') as f:
-        json.dump(enriched_data, f, indent=2)
+    write_json_array(enriched_data, CONFIG["OUTPUT_JSON"])
     
     # Print statistics
     print("\n📊 Enrichment Statistics:")
@@ -1,57 +1,89 @@
 # drug.py
 
 import json
-from chembl_webresource_client.new_client import new_client
+import os
+import re
+import sys
+import numpy as np
+import chembl_api
+from chembl_api import search_molecules, has_molecule_details, filter_records_in
+from concurrent.futures import ThreadPoolExecutor
+from rapidfuzz import process, fuzz
 from tqdm import tqdm
-from functools import lru_cache
-
-# --- Load JSON input ---
-with open("aacrArticle.json", "r") as f:
-    data = json.load(f)
-
-# Extract all unique drug aliases
-alias_to_entry = {}
-
-for entry in data:
-    for drug in entry.get("extractedDrugs", []):
-        name = drug.get("drugName")
-        aliases = drug.get("drugAlias") or []
-        if isinstance(aliases, str):
-            aliases = [aliases]
-        all_aliases = list(set(aliases + [name])) if name else aliases
-        for alias in all_aliases:
-            if alias:
-                alias_to_entry[alias] = {
-                    "entry_id": entry.get("id"),
-                    "all_aliases": all_aliases
-                }
-
-alias_list = sorted(alias_to_entry.keys())
-
-# --- Initialize ChEMBL clients ---
-molecule_client = new_client.molecule
-mechanism_client = new_client.mechanism
-indication_client = new_client.drug_indication
-target_client = new_client.target
-
-# --- Fetch full ChEMBL drug record ---
-def fetch_full_chembl_data(drug_name):
+
+# Normalized aliases at or above this fuzz.ratio (with identical digit runs) share one ChEMBL search
+ALIAS_CLUSTER_CUTOFF = 90
+# Concurrent ChEMBL searches; metadata is then fetched in bulk per resource
+CHEMBL_WORKERS = 16
+
+NON_ALPHANUMERIC_PATTERN = re.compile(r'[^a-z0-9]')
+DIGIT_RUN_PATTERN = re.compile(r'\d+')
+
+def drug_aliases(drug):
+    """drugAlias coerced to a list (a bare string or null is allowed) and unioned with drugName"""
+    name = drug.get("drugName")
+    aliases = drug.get("drugAlias") or []
+    if isinstance(aliases, str):
+        aliases = [aliases]
+    return list({*aliases, name}) if name else aliases
+
+def collect_aliases(data):
+    """Every distinct non-empty drug name or alias in the articles, sorted"""
+    return sorted({alias for entry in data for drug in entry.get("extractedDrugs", [])
+                   for alias in drug_aliases(drug) if alias})
+
+# --- Cluster near-duplicate aliases ("SGN-35" / "SGN35") so each cluster is searched once ---
+def normalize_alias(alias):
+    return NON_ALPHANUMERIC_PATTERN.sub('', alias.lower())
+
+def cluster_aliases(aliases):
+    """Map each alias to its cluster's representative (the longest member) via union-find"""
+    normalized = {alias: normalize_alias(alias) for alias in aliases}
+    keys = list(dict.fromkeys(normalized.values()))
+    digit_runs = [DIGIT_RUN_PATTERN.findall(key) for key in keys]
+    parent = list(range(len(keys)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    scores = process.cdist(keys, keys, scorer=fuzz.ratio, score_cutoff=ALIAS_CLUSTER_CUTOFF, dtype=np.uint8, workers=-1)
+    for i, j in zip(*np.nonzero(np.triu(scores, 1))):
+        # Codes like "PF-08046031" / "PF-08046032" are different compounds, so digits must agree
+        if keys[i] and keys[j] and digit_runs[i] == digit_runs[j]:
+            parent[find(i)] = find(j)
+
+    key_index = {key: i for i, key in enumerate(keys)}
+    clusters = {}
+    for alias in aliases:
+        clusters.setdefault(find(key_index[normalized[alias]]), []).append(alias)
+    return {alias: max(members, key=len) for members in clusters.values() for alias in members}
+
+# --- Pass 1 helpers: resolve names to ADC molecules ---
+def search_top_hit(drug_name):
+    """Top ChEMBL search hit for a name, or None if the search fails or is empty"""
     try:
-        results = molecule_client.search(drug_name)
+        results = search_molecules(drug_name)
     except Exception:
         return None
-    if not results:
-        return None
+    return results[0] if results else None
 
-    mol_info = results[0]
-    chembl_id = mol_info['molecule_chembl_id']
-    molecule_details = molecule_client.get(chembl_id)
+def is_named_adc(mol_info, molecule_details):
+    if not molecule_details or molecule_details.get('molecule_type') != 'Antibody drug conjugate':
+        return False
+    return bool(mol_info.get('pref_name')) or molecule_details.get('max_phase') is not None
 
-    if molecule_details.get('molecule_type') != 'Antibody drug conjugate':
-        return None
+def group_by(records, field):
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record.get(field), []).append(record)
+    return grouped
 
-    if not mol_info.get('pref_name') and molecule_details.get('max_phase') is None:
-        return None
+# --- Assemble a full ChEMBL drug record from prefetched data ---
+def build_chembl_record(mol_info, molecule_details, moas_raw, indications_raw, target_records):
+    chembl_id = mol_info['molecule_chembl_id']
 
     # --- Molecule Info ---
     molecule_info = {
@@ -69,7 +101,6 @@ def fetch_full_chembl_data(drug_name):
     }
 
     # --- Mechanism of Action ---
-    moas_raw = list(mechanism_client.filter(molecule_chembl_id=chembl_id))
     moas = []
     targets_seen = set()
     for m in moas_raw:
@@ -84,7 +115,6 @@ def fetch_full_chembl_data(drug_name):
             targets_seen.add(target_id)
 
     # --- Drug Indications ---
-    indications_raw = indication_client.filter(molecule_chembl_id=chembl_id)
     indications = [{
         'EFO ID': ind.get('efo_id'),
         'EFO Term': ind.get('efo_term'),
@@ -98,7 +128,7 @@ def fetch_full_chembl_data(drug_name):
     target_pref_name_map = {}
     for tid in targets_seen:
         try:
-            t = target_client.get(tid)
+            t = target_records[tid]
             targets.append({
                 'Target ChEMBL ID': t.get('target_chembl_id'),
                 'Pref Name': t.get('pref_name'),
@@ -139,57 +169,121 @@ def fetch_full_chembl_data(drug_name):
         'Target Metadata': targets
     }
 
-# --- LRU Cache to avoid re-fetching the same name ---
-@lru_cache(maxsize=None)
-def fetch_full_chembl_data_cached(name):
-    return fetch_full_chembl_data(name)
+# --- Pass 1: search each distinct name once, concurrently ---
+def resolve_adc_hits(names, executor, top_hits, molecule_details, progress=False):
+    """Record each name's top ADC hit (or None) in top_hits. Hits returned without full molecule
+    details have them fetched in one bulk query"""
+    hits = executor.map(search_top_hit, names)
+    if progress:
+        hits = tqdm(hits, total=len(names), desc="Matching aliases to ChEMBL")
+    hits = dict(zip(names, hits))
+    for hit in hits.values():
+        if hit and has_molecule_details(hit):
+            molecule_details.setdefault(hit['molecule_chembl_id'], hit)
+    new_ids = {hit['molecule_chembl_id'] for hit in hits.values() if hit} - molecule_details.keys()
+    for molecule in filter_records_in('molecule', 'molecules', 'molecule_chembl_id', new_ids):
+        molecule_details[molecule['molecule_chembl_id']] = molecule
+    for name, hit in hits.items():
+        top_hits[name] = hit if hit and is_named_adc(hit, molecule_details.get(hit['molecule_chembl_id'])) else None
+
+def fetch_chembl_records(alias_list, alias_representative):
+    """Map every searched name to its full ChEMBL record, or None if it did not resolve to a named ADC"""
+    # Cluster representatives are searched first, then any alias whose representative missed
+    top_hits = {}
+    molecule_details = {}
+    with ThreadPoolExecutor(max_workers=CHEMBL_WORKERS) as executor:
+        resolve_adc_hits(sorted(set(alias_representative.values())), executor, top_hits, molecule_details, progress=True)
+        retries = [alias for alias in alias_list if alias not in top_hits and not top_hits[alias_representative[alias]]]
+        resolve_adc_hits(retries, executor, top_hits, molecule_details)
+
+    # --- Pass 2: bulk-fetch mechanisms, indications and targets for every resolved molecule ---
+    adc_hits = {hit['molecule_chembl_id']: hit for hit in top_hits.values() if hit}
+    mechanisms = group_by(filter_records_in('mechanism', 'mechanisms', 'molecule_chembl_id', adc_hits), 'molecule_chembl_id')
+    indications = group_by(filter_records_in('drug_indication', 'drug_indications', 'molecule_chembl_id', adc_hits), 'molecule_chembl_id')
+    target_ids = {m['target_chembl_id'] for moas in mechanisms.values() for m in moas if m.get('target_chembl_id')}
+    target_records = {t['target_chembl_id']: t for t in filter_records_in('target', 'targets', 'target_chembl_id', target_ids)}
+
+    # --- Pass 3: assemble one record per molecule locally ---
+    chembl_records = {
+        chembl_id: build_chembl_record(hit, molecule_details[chembl_id], mechanisms.get(chembl_id, []),
+                                       indications.get(chembl_id, []), target_records)
+        for chembl_id, hit in adc_hits.items()
+    }
+    return {name: chembl_records[hit['molecule_chembl_id']] if hit else None for name, hit in top_hits.items()}
 
 # --- Match aliases to ChEMBL ---
-chembl_dict = {}
-for alias in tqdm(alias_list, desc="Matching aliases to ChEMBL"):
-    result = fetch_full_chembl_data_cached(alias)
-    if result and result.get("ChEMBL ID"):
-        chembl_id = result["ChEMBL ID"]
-        if chembl_id not in chembl_dict:
-            result['All Aliases'] = [alias.upper()]
-            chembl_dict[chembl_id] = result
-        else:
-            if alias.upper() not in chembl_dict[chembl_id]['All Aliases']:
-                chembl_dict[chembl_id]['All Aliases'].append(alias.upper())
-                chembl_dict[chembl_id]['All Aliases'] = list(set(chembl_dict[chembl_id]['All Aliases']))
-
-# --- Export cleaned dictionary ---
-import os
-os.makedirs("dictionaries/drug", exist_ok=True)
-with open("dictionaries/drug/chembl_drug_dictionary.json", "w") as f:
-    json.dump(chembl_dict, f, indent=2)
+def build_chembl_dict(alias_list, alias_representative, fetched):
+    """ChEMBL ID -> record with the sorted upper-cased aliases that resolved to it"""
+    # Merged sequentially in alias order so the dictionary is deterministic without locking
+    chembl_dict = {}
+    for alias in alias_list:
+        result = fetched[alias_representative[alias]] or fetched.get(alias)
+        if result and result.get("ChEMBL ID"):
+            chembl_id = result["ChEMBL ID"]
+            if chembl_id not in chembl_dict:
+                # Accumulate aliases in a set; sorted into a list once below
+                result['All Aliases'] = {alias.upper()}
+                chembl_dict[chembl_id] = result
+            else:
+                chembl_dict[chembl_id]['All Aliases'].add(alias.upper())
 
-print(f"✅ Saved {len(chembl_dict)} unique ADC drugs to dictionaries/drug/chembl_drug_dictionary.json")
+    for result in chembl_dict.values():
+        result['All Aliases'] = sorted(result['All Aliases'])
+    return chembl_dict
 
 # --- Update input JSON with ChEMBL fields ---
-for entry in data:
-    for drug in entry.get("extractedDrugs", []):
-        name = drug.get("drugName")
-        aliases = drug.get("drugAlias") or []
-        if isinstance(aliases, str):
-            aliases = [aliases]
-        all_aliases = list(set(aliases + [name])) if name else aliases
-
-        match = None
-        for alias in all_aliases:
-            for chembl_id, result in chembl_dict.items():
-                if alias.upper() in result['All Aliases']:
-                    match = result
-                    break
+def enrich_drugs(data, chembl_dict):
+    # Each record's output fields are derived once, keyed by every alias it carries (first record wins)
+    alias_fields = {}
+    for result in chembl_dict.values():
+        fields = (
+            result.get('Preferred Name'),
+            list({m.get('Mechanism of Action') for m in result.get('Mechanism of Action', []) if m.get('Mechanism of Action')})
+        )
+        for alias in result['All Aliases']:
+            alias_fields.setdefault(alias, fields)
+
+    for entry in data:
+        for drug in entry.get("extractedDrugs", []):
+            match = next(filter(None, (alias_fields.get(a.upper()) for a in drug_aliases(drug))), None)
             if match:
-                break
+                drug['drugNameChembl'], moa_names = match
+                drug['mechanismOfActionChembl'] = list(moa_names)
+
+def main():
+    # --- Load JSON input ---
+    with open("aacrArticle.json", "r") as f:
+        data = json.load(f)
+
+    alias_list = collect_aliases(data)
+    alias_representative = cluster_aliases(alias_list)
+
+    # --- Reuse ChEMBL responses from earlier runs unless --no-cache is given ---
+    # A failed search only misses that name, but a bulk query that still fails after retries
+    # aborts the run rather than leave records without mechanisms or targets. Responses fetched
+    # so far are saved either way, so a rerun repeats only the failed request
+    chembl_api.load_cache(use_existing="--no-cache" not in sys.argv)
+    try:
+        fetched = fetch_chembl_records(alias_list, alias_representative)
+    finally:
+        chembl_api.save_cache()
+
+    chembl_dict = build_chembl_dict(alias_list, alias_representative, fetched)
+
+    # --- Export cleaned dictionary ---
+    os.makedirs("dictionaries/drug", exist_ok=True)
+    with open("dictionaries/drug/chembl_drug_dictionary.json", "w") as f:
+        json.dump(chembl_dict, f, indent=2)
+
+    print(f"✅ Saved {len(chembl_dict)} unique ADC drugs to dictionaries/drug/chembl_drug_dictionary.json")
+
+    enrich_drugs(data, chembl_dict)
 
-        if match:
-            drug['drugNameChembl'] = match.get('Preferred Name')
-            drug['mechanismOfActionChembl'] = list({m.get('Mechanism of Action') for m in match.get('Mechanism of Action', []) if m.get('Mechanism of Action')})
+    # --- Save updated JSON ---
+    with open("dictionaries/drug/aacrArticle_chembl_enriched.json", "w") as f:
+        json.dump(data, f, indent=2)
 
-# --- Save updated JSON ---
-with open("dictionaries/drug/aacrArticle_chembl_enriched.json", "w") as f:
-    json.dump(data, f, indent=2)
+    print("✅ Saved enriched input JSON to dictionaries/drug/aacrArticle_chembl_enriched.json")
 
-print("✅ Saved enriched input JSON to dictionaries/drug/aacrArticle_chembl_enriched.json")
+if __name__ == "__main__":
+    main()
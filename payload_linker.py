@@ -1,9 +1,13 @@
 import json
+import orjson
+import os
 import re
+import sys
 from time import sleep
 from tqdm import tqdm
-from functools import lru_cache
-from chembl_webresource_client.new_client import new_client
+from concurrent.futures import ThreadPoolExecutor
+import chembl_api
+from chembl_api import search_molecules, has_molecule_details, filter_records_in
 
 # ------------------
 # CONFIGURATION
@@ -12,74 +16,84 @@ INPUT_JSON = "aacrArticle.json"
 OUTPUT_JSON = "dictionaries/payload_linker/aacrArticle_chembl_payload_linker_enriched.json"
 PAYLOAD_DICT_OUTPUT = "chembl_payload_dictionary.json"
 LINKER_DICT_OUTPUT = "chembl_linker_dictionary.json"
+CHEMBL_WORKERS = 16  # Concurrent ChEMBL searches; each one is I/O-bound
 
 # ------------------
 # LOAD DATA
 # ------------------
-with open(INPUT_JSON, "r") as f:
-    data = json.load(f)
+def load_articles(path):
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
 
 # ------------------
 # EXTRACT UNIQUE PAYLOADS AND LINKERS
 # ------------------
-payload_set = set()
-linker_set = set()
+def extract_components(articles):
+    """Sorted unique (payloads, linkers) named across the articles"""
+    payload_set = set()
+    linker_set = set()
 
-for entry in data:
-    for drug in entry.get("extractedDrugs", []):
-        # Extract payloads
-        payload = drug.get("payload")
-        if isinstance(payload, str):
-            payload_set.add(payload.strip())
-        elif isinstance(payload, list):
-            for p in payload:
-                payload_set.add(str(p).strip())
-        
-        # Extract linkers
-        linker = drug.get("linker")
-        if isinstance(linker, str):
-            linker_set.add(linker.strip())
-        elif isinstance(linker, list):
-            for l in linker:
-                linker_set.add(str(l).strip())
+    for entry in articles:
+        for drug in entry.get("extractedDrugs", []):
+            # Extract payloads
+            payload = drug.get("payload")
+            if isinstance(payload, str):
+                payload_set.add(payload.strip())
+            elif isinstance(payload, list):
+                for p in payload:
+                    payload_set.add(str(p).strip())
 
-payload_list = sorted(payload_set)
-linker_list = sorted(linker_set)
+            # Extract linkers
+            linker = drug.get("linker")
+            if isinstance(linker, str):
+                linker_set.add(linker.strip())
+            elif isinstance(linker, list):
+                for l in linker:
+                    linker_set.add(str(l).strip())
 
-print(f"Found {len(payload_list)} unique payloads and {len(linker_list)} unique linkers")
+    return sorted(payload_set), sorted(linker_set)
 
 # ------------------
 # UTILS
 # ------------------
+# "Name (alias)" -> the outside and inside of the trailing parenthetical
+PAREN_PATTERN = re.compile(r"^(.*?)\s*\((.*?)\)$")
+# Names made only of digits and punctuation, or placeholder values, never resolve in ChEMBL
+UNSEARCHABLE_PATTERN = re.compile(r"^[\d\W_]+$")
+PLACEHOLDER_NAMES = {"unknown", "n/a", "na", "none", "nan", "null", "not specified", "undisclosed"}
+
 def expand_component_name(name):
-    match = re.match(r"^(.*?)\s*\((.*?)\)$", name)
+    if "(" not in name:
+        return [name.strip()]
+    match = PAREN_PATTERN.match(name)
     if match:
         outside, inside = match.groups()
         return [outside.strip(), inside.strip()]
     return [name.strip()]
 
+def is_searchable(name):
+    """False for names too short, placeholder or symbol-only to be worth a ChEMBL search"""
+    name = name.strip()
+    return len(name) >= 3 and name.lower() not in PLACEHOLDER_NAMES and not UNSEARCHABLE_PATTERN.match(name)
+
 # ------------------
 # QUERY ChEMBL
 # ------------------
-molecule_client = new_client.molecule
-mechanism_client = new_client.mechanism
-indication_client = new_client.drug_indication
-target_client = new_client.target
+# Lower-cased search term -> component record (None on a miss), filled by prefetch_component_matches;
+# ChEMBL search is case-insensitive, so "MMAE" and "mmae" share one lookup
+component_records = {}
 
-@lru_cache(maxsize=None)
-def fetch_full_chembl_data(component_name):
+def search_top_hit(component_name):
     try:
-        results = molecule_client.search(component_name)
+        results = search_molecules(component_name)
     except Exception as e:
         # Handle API errors gracefully
         print(f"Warning: API error for '{component_name}': {str(e)}")
         return None
-    if not results:
-        return None
+    return results[0] if results else None
 
-    mol_info = results[0]
+def build_component_record(mol_info, molecule_details):
     chembl_id = mol_info['molecule_chembl_id']
-    molecule_details = molecule_client.get(chembl_id)
 
     # Filter for small molecule drugs only
     if molecule_details.get('molecule_type') != 'Small molecule':
@@ -113,74 +127,75 @@ def fetch_full_chembl_data(component_name):
 def best_component_match(raw_name):
     variants = expand_component_name(raw_name)
     for name in variants:
-        # Skip very short search terms that will cause API errors
-        if len(name.strip()) < 3:
+        # Skip terms that would cause API errors or are guaranteed misses
+        if not is_searchable(name):
             continue
-        result = fetch_full_chembl_data(name)
+        result = component_records.get(name.lower())
         if result and result.get("ChEMBL ID"):
             return result
     return None
 
+def prefetch_component_matches(raw_names):
+    """Resolve every name's search variants into component_records, searching concurrently and
+    moving to the next variant only for names whose current one missed. Hits returned without
+    full molecule details have them fetched in one bulk query per round."""
+    pending = {}
+    for raw_name in raw_names:
+        variants = [name.lower() for name in expand_component_name(raw_name) if is_searchable(name)]
+        if variants:
+            pending[raw_name] = variants
+
+    with ThreadPoolExecutor(max_workers=CHEMBL_WORKERS) as executor:
+        while pending:
+            terms = sorted({variants[0] for variants in pending.values()} - component_records.keys())
+            hits = dict(zip(terms, executor.map(search_top_hit, terms)))
+            details = {hit['molecule_chembl_id']: hit for hit in hits.values() if hit and has_molecule_details(hit)}
+            missing_ids = {hit['molecule_chembl_id'] for hit in hits.values() if hit} - details.keys()
+            details.update((m['molecule_chembl_id'], m) for m in filter_records_in('molecule', 'molecules', 'molecule_chembl_id', missing_ids))
+            for term, hit in hits.items():
+                found = hit and hit['molecule_chembl_id'] in details
+                component_records[term] = build_component_record(hit, details[hit['molecule_chembl_id']]) if found else None
+            pending = {raw_name: variants[1:] for raw_name, variants in pending.items()
+                       if len(variants) > 1 and not component_records[variants[0]]}
+
 # ------------------
-# BUILD PAYLOAD LOOKUP DICT
-# ------------------
-print("\n🔍 Processing Payloads...")
-payload_dict = {}
-for payload in tqdm(payload_list, desc="Querying ChEMBL for payloads"):
-    # Skip very short payload names
-    if len(payload.strip()) < 3:
-        print(f"Skipping short payload name: '{payload}'")
-        continue
-        
-    result = best_component_match(payload)
-    if result and result.get("ChEMBL ID"):
-        chembl_id = result["ChEMBL ID"]
-        if chembl_id not in payload_dict:
-            result['All Aliases'] = [payload.upper()]
-            payload_dict[chembl_id] = result
-        else:
-            if payload.upper() not in payload_dict[chembl_id]['All Aliases']:
-                payload_dict[chembl_id]['All Aliases'].append(payload.upper())
-                payload_dict[chembl_id]['All Aliases'] = list(set(payload_dict[chembl_id]['All Aliases']))
-
-# ------------------
-# BUILD LINKER LOOKUP DICT
-# ------------------
-print("\n🔗 Processing Linkers...")
-linker_dict = {}
-for linker in tqdm(linker_list, desc="Querying ChEMBL for linkers"):
-    # Skip very short linker names
-    if len(linker.strip()) < 3:
-        print(f"Skipping short linker name: '{linker}'")
-        continue
-        
-    result = best_component_match(linker)
-    if result and result.get("ChEMBL ID"):
-        chembl_id = result["ChEMBL ID"]
-        if chembl_id not in linker_dict:
-            result['All Aliases'] = [linker.upper()]
-            linker_dict[chembl_id] = result
-        else:
-            if linker.upper() not in linker_dict[chembl_id]['All Aliases']:
-                linker_dict[chembl_id]['All Aliases'].append(linker.upper())
-                linker_dict[chembl_id]['All Aliases'] = list(set(linker_dict[chembl_id]['All Aliases']))
-
-# ------------------
-# SAVE DICTIONARIES
+# BUILD PAYLOAD / LINKER LOOKUP DICTS
 # ------------------
-import os
-os.makedirs("dictionaries/payload_linker", exist_ok=True)
+def build_component_dict(names, kind):
+    """ChEMBL ID -> record with the sorted upper-cased names resolving to it (kind: "payload" or "linker")"""
+    component_dict = {}
+    for name in tqdm(names, desc=f"Querying ChEMBL for {kind}s"):
+        # Skip very short names
+        if len(name.strip()) < 3:
+            print(f"Skipping short {kind} name: '{name}'")
+            continue
 
-with open("dictionaries/payload_linker/chembl_payload_dictionary.json", "w") as f:
-    json.dump(payload_dict, f, indent=2)
+        result = best_component_match(name)
+        if result and result.get("ChEMBL ID"):
+            chembl_id = result["ChEMBL ID"]
+            if chembl_id not in component_dict:
+                # Accumulate aliases in a set; sorted into a list once below
+                result['All Aliases'] = {name.upper()}
+                component_dict[chembl_id] = result
+            else:
+                component_dict[chembl_id]['All Aliases'].add(name.upper())
 
-with open("dictionaries/payload_linker/chembl_linker_dictionary.json", "w") as f:
-    json.dump(linker_dict, f, indent=2)
+    for result in component_dict.values():
+        result['All Aliases'] = sorted(result['All Aliases'])
+    return component_dict
 
 # ------------------
 # ENRICH JSON INPUT
 # ------------------
-for entry in data:
+def build_alias_index(component_dict):
+    """Invert a component dictionary to upper-cased alias -> record (first record wins)"""
+    index = {}
+    for result in component_dict.values():
+        for alias in result['All Aliases']:
+            index.setdefault(alias, result)
+    return index
+
+def enrich_entry(entry, payload_alias_index, linker_alias_index):
     for drug in entry.get("extractedDrugs", []):
         # Process payloads
         payload = drug.get("payload")
@@ -195,10 +210,9 @@ for entry in data:
             # Find matching ChEMBL records for payloads
             payload_matches = []
             for p in payload_list:
-                for chembl_id, result in payload_dict.items():
-                    if p.upper() in result['All Aliases']:
-                        payload_matches.append(result)
-                        break
+                result = payload_alias_index.get(p.upper())
+                if result:
+                    payload_matches.append(result)
 
             if payload_matches:
                 # Add payload fields
@@ -221,10 +235,9 @@ for entry in data:
             # Find matching ChEMBL records for linkers
             linker_matches = []
             for l in linker_list:
-                for chembl_id, result in linker_dict.items():
-                    if l.upper() in result['All Aliases']:
-                        linker_matches.append(result)
-                        break
+                result = linker_alias_index.get(l.upper())
+                if result:
+                    linker_matches.append(result)
 
             if linker_matches:
                 # Add linker fields
@@ -237,9 +250,56 @@ for entry in data:
 # ------------------
 # SAVE ENRICHED JSON
 # ------------------
-with open(OUTPUT_JSON, "w") as f:
-    json.dump(data, f, indent=2)
+def write_enriched_json(path, articles, payload_dict, linker_dict):
+    """Enrich each article in place and write the list as compact UTF-8 JSON, serializing one
+    entry at a time. Only the small dictionary files are pretty-printed"""
+    payload_alias_index = build_alias_index(payload_dict)
+    linker_alias_index = build_alias_index(linker_dict)
+    with open(path, "wb") as f:
+        f.write(b"[")
+        for i, entry in enumerate(articles):
+            enrich_entry(entry, payload_alias_index, linker_alias_index)
+            if i:
+                f.write(b",")
+            f.write(orjson.dumps(entry, option=orjson.OPT_NON_STR_KEYS))
+        f.write(b"]")
+
+# ------------------
+# MAIN EXECUTION
+# ------------------
+def main():
+    articles = load_articles(INPUT_JSON)
+    payload_list, linker_list = extract_components(articles)
+    print(f"Found {len(payload_list)} unique payloads and {len(linker_list)} unique linkers")
+
+    print("\n⚡ Prefetching ChEMBL records...")
+    # Reuse ChEMBL responses from earlier runs unless --no-cache is given. A failed bulk
+    # molecule query aborts the run (as in drug.py), after saving the responses fetched so far
+    chembl_api.load_cache(use_existing="--no-cache" not in sys.argv)
+    try:
+        prefetch_component_matches([name for name in payload_list + linker_list if is_searchable(name)])
+    finally:
+        chembl_api.save_cache()
+
+    print("\n🔍 Processing Payloads...")
+    payload_dict = build_component_dict(payload_list, "payload")
+
+    print("\n🔗 Processing Linkers...")
+    linker_dict = build_component_dict(linker_list, "linker")
+
+    os.makedirs("dictionaries/payload_linker", exist_ok=True)
+
+    with open("dictionaries/payload_linker/chembl_payload_dictionary.json", "w") as f:
+        json.dump(payload_dict, f, indent=2)
+
+    with open("dictionaries/payload_linker/chembl_linker_dictionary.json", "w") as f:
+        json.dump(linker_dict, f, indent=2)
+
+    write_enriched_json(OUTPUT_JSON, articles, payload_dict, linker_dict)
+
+    print(f"\n✅ Saved {len(payload_dict)} unique payload mappings to dictionaries/payload_linker/chembl_payload_dictionary.json")
+    print(f"✅ Saved {len(linker_dict)} unique linker mappings to dictionaries/payload_linker/chembl_linker_dictionary.json")
+    print(f"✅ Saved enriched JSON to {OUTPUT_JSON}")
 
-print(f"\n✅ Saved {len(payload_dict)} unique payload mappings to dictionaries/payload_linker/chembl_payload_dictionary.json")
-print(f"✅ Saved {len(linker_dict)} unique linker mappings to dictionaries/payload_linker/chembl_linker_dictionary.json")
-print(f"✅ Saved enriched JSON to {OUTPUT_JSON}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# pipeline_utils.py
+
+"""
+Helpers shared by the enrichment scripts: a streaming writer for the indented
+JSON arrays they emit, and the partial matcher behind the variation tables of
+company.py and biomarker_strategy.py.
+"""
+
+from typing import Dict, Iterable, Optional
+
+import ahocorasick
+import orjson
+
+
+def write_json_array(records: Iterable, path: str):
+    """
+    Write records as an indented JSON array, serializing one record at a time.
+    The bytes match orjson.dumps(list(records), option=OPT_INDENT_2), but the whole
+    array is never built in memory, so records may be a generator.
+    """
+    with open(path, "wb") as f:
+        empty = True
+        for record in records:
+            f.write(b"[\n  " if empty else b",\n  ")
+            # orjson escapes newlines inside strings, so every b"\n" is a line break to indent
+            f.write(orjson.dumps(record, option=orjson.OPT_INDENT_2).replace(b"\n", b"\n  "))
+            empty = False
+        f.write(b"[]" if empty else b"\n]")
+
+
+def build_variation_automaton(variations: Dict[str, str]) -> ahocorasick.Automaton:
+    """Build an Aho-Corasick automaton over the variation keys, tagged with (position, standard form)"""
+    automaton = ahocorasick.Automaton()
+    for position, (variation, standard) in enumerate(variations.items()):
+        automaton.add_word(variation, (position, standard))
+    automaton.make_automaton()
+    return automaton
+
+
+def match_partial_variation(text_lower: str, variations: Dict[str, str],
+                            automaton: ahocorasick.Automaton, joined: str) -> Optional[str]:
+    """
+    Return the standard form of the first variation (in dict order) that occurs in
+    text_lower or contains it, or None. automaton comes from build_variation_automaton
+    and joined is the variation keys joined by newlines.
+    """
+    best = None
+    for _, hit in automaton.iter(text_lower):
+        if best is None or hit < best:
+            best = hit
+
+    # A substring test on the joined keys rules most texts out of the reverse check at once
+    if text_lower in joined:
+        for position, (variation, standard) in enumerate(variations.items()):
+            if best is not None and position >= best[0]:
+                break
+            if text_lower in variation:
+                best = (position, standard)
+                break
+
+    return best[1] if best else None
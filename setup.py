@@ -33,7 +33,10 @@ def check_dependencies():
         "numpy", 
         "tqdm",
         "owlready2",
-        "chembl_webresource_client"
+        "requests",
+        "rapidfuzz",
+        "orjson",
+        "ahocorasick"
     ]
     
     missing_packages = []
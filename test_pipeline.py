@@ -5,83 +5,173 @@ Test script for the unified enrichment pipeline
 This script validates the pipeline output and provides quality metrics.
 """
 
-import json
+import orjson
 import sys
 from pathlib import Path
-from collections import defaultdict, Counter
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-def load_json_safe(file_path):
-    """Safely load JSON file with error handling"""
+@lru_cache(maxsize=None)
+def _load_json(path, mtime_ns):
+    """Parse a JSON file from one buffered binary read; keyed on mtime so an edited file is reparsed"""
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+def load_json_safe(file_path, memoize=True):
+    """Safely load JSON file with error handling; with memoize, repeat loads of an unchanged file are
+    served from memory (pass memoize=False for large one-pass inputs so they are not pinned)"""
     try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
+        path = Path(file_path).resolve()
+        load = _load_json if memoize else _load_json.__wrapped__
+        return load(str(path), path.stat().st_mtime_ns)
     except FileNotFoundError:
         print(f"❌ File not found: {file_path}")
         return None
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"❌ JSON decode error in {file_path}: {e}")
         return None
 
-def analyze_enriched_data(data):
-    """Analyze the enriched data and provide quality metrics"""
-    print("📊 Analyzing enriched data...")
-    
-    total_entries = len(data)
+# Input field behind each ontology type, and the placeholder value meaning "no input"
+INPUT_FIELDS = {
+    "drug": ("drugName", "unknown"),
+    "antigen": ("targetAntigen", ["unknown"]),
+    "disease": ("cancerIndication", ["unknown"]),
+    "payload": ("payload", ["unknown"]),
+    "linker": ("linker", "unknown"),
+    "company": ("company", "unknown"),
+    "trial_design": ("trialDesign", "unknown"),
+    "biomarker_strategy": ("biomarkerStrategy", "unknown")
+}
+
+INPUT_BITS = {ontology_type: 1 << i for i, ontology_type in enumerate(INPUT_FIELDS)}
+
+def input_mask(drug):
+    """Bitmask of INPUT_BITS for the ontology types the drug carries real (non-placeholder) input for"""
+    mask = 0
+    for ontology_type, (field, placeholder) in INPUT_FIELDS.items():
+        value = drug.get(field)
+        if value and value != placeholder:
+            mask |= INPUT_BITS[ontology_type]
+    return mask
+
+# Cleaned-value key inside each enriched field's ontology record
+ENRICHED_FIELDS = {
+    "company": "companyCleaned",
+    "trial_design": "trialDesignCleaned",
+    "biomarker_strategy": "biomarkerStrategyCleaned"
+}
+REQUIRED_FIELDS = ("id", "extractedDrugs")
+ONTOLOGY_FIELDS = ("drug", "antigen", "disease", "payload", "linker", "company", "trial_design", "biomarker_strategy")
+MATCH_STATUS_FIELDS = frozenset(("drug", "antigen", "disease", "payload", "linker"))
+# Structure checking stops at the first entry after this many errors; the stats pass continues
+MAX_STRUCTURE_ERRORS = 100
+# Structure errors are recorded as (kind, entry index, drug index, field) and only formatted when shown
+STRUCTURE_ERROR_MESSAGES = {
+    "missing_field": "Entry {i}: Missing required field '{field}'",
+    "missing_ontology": "Entry {i}, Drug {j}: Missing ontology field '{field}'",
+    "missing_match_status": "Entry {i}, Drug {j}: Missing match_status in {field}",
+    "not_dict": "Entry {i}, Drug {j}: '{field}' is not a dictionary"
+}
+
+def format_structure_error(error):
+    kind, i, j, field = error
+    return STRUCTURE_ERROR_MESSAGES[kind].format(i=i, j=j, field=field)
+
+Report = namedtuple("Report", ["total_entries", "total_drugs", "ontology_stats", "enriched_stats",
+                               "structure_errors", "unexamined_entries", "best_mapped"])
+
+def build_report(data):
+    """Collect every metric the checks below print in a single pass over the data"""
+    total_entries = 0
     total_drugs = 0
-    ontology_stats = defaultdict(lambda: {"matched": 0, "unknown": 0, "total_with_input": 0})
+    input_counter = Counter()
+    matched_counter = Counter()
+    enriched_input_counter = Counter()
+    cleaned_counter = Counter()
+    structure_errors = []
+    unexamined_entries = 0
+    best_mapped = None  # (entry, drug, match_count) of the first drug with the most matches, if >= 3
+    best_count = 2
     
-    # Collect statistics
-    for entry in data:
-        for drug in entry.get("extractedDrugs", []):
+    for i, entry in enumerate(data):
+        total_entries += 1
+        check_structure = len(structure_errors) < MAX_STRUCTURE_ERRORS
+        if check_structure:
+            # Check required fields
+            for field in REQUIRED_FIELDS:
+                if field not in entry:
+                    structure_errors.append(("missing_field", i, None, field))
+        else:
+            unexamined_entries += 1
+        
+        for j, drug in enumerate(entry.get("extractedDrugs", [])):
             total_drugs += 1
             ontology = drug.get("ontology", {})
+            mask = input_mask(drug)
             
-                # Check for input data for each ontology type
-    has_drug_input = drug.get("drugName") and drug.get("drugName") != "unknown"
-    has_antigen_input = drug.get("targetAntigen") and drug.get("targetAntigen") != ["unknown"]
-    has_disease_input = drug.get("cancerIndication") and drug.get("cancerIndication") != ["unknown"]
-    has_payload_input = drug.get("payload") and drug.get("payload") != ["unknown"]
-    has_linker_input = drug.get("linker") and drug.get("linker") != "unknown"
-    has_company_input = drug.get("company") and drug.get("company") != "unknown"
-    has_trial_design_input = drug.get("trialDesign") and drug.get("trialDesign") != "unknown"
-    has_biomarker_input = drug.get("biomarkerStrategy") and drug.get("biomarkerStrategy") != "unknown"
-    
-    # Map ontology types to their input availability
-    input_availability = {
-        "drug": has_drug_input,
-        "antigen": has_antigen_input,
-        "disease": has_disease_input,
-        "payload": has_payload_input,
-        "linker": has_linker_input,
-        "company": has_company_input,
-        "trial_design": has_trial_design_input,
-        "biomarker_strategy": has_biomarker_input
-    }
-    
-    for entry in data:
-        for drug in entry.get("extractedDrugs", []):
-            total_drugs += 1
-            ontology = drug.get("ontology", {})
+            # Ontology match rates: only count ontology types this drug had input data for
+            inputs = [ontology_type for ontology_type in ontology if INPUT_BITS.get(ontology_type, 0) & mask]
+            input_counter.update(inputs)
+            matched_counter.update(ontology_type for ontology_type in inputs
+                                   if ontology[ontology_type].get("match_status", "unknown") != "unknown")
+            
+            # Enriched fields: cleaned company / trial design / biomarker strategy values
+            for field_type, cleaned_key in ENRICHED_FIELDS.items():
+                if mask & INPUT_BITS[field_type]:
+                    enriched_input_counter[field_type] += 1
+                    field_data = ontology.get(field_type, {})
+                    cleaned = field_data.get(cleaned_key) if isinstance(field_data, dict) else None
+                    if cleaned and cleaned != "unknown":
+                        cleaned_counter[field_type] += 1
+            
+            # Drug ontology structure
+            if check_structure:
+                for ontology_type in ONTOLOGY_FIELDS:
+                    if ontology_type not in ontology:
+                        structure_errors.append(("missing_ontology", i, j, ontology_type))
+                    elif ontology_type in MATCH_STATUS_FIELDS:
+                        if "match_status" not in ontology[ontology_type]:
+                            structure_errors.append(("missing_match_status", i, j, ontology_type))
+                    elif not isinstance(ontology[ontology_type], dict):
+                        structure_errors.append(("not_dict", i, j, ontology_type))
             
-            for ontology_type, ontology_data in ontology.items():
-                match_status = ontology_data.get("match_status", "unknown")
-                
-                # Only count if there was input data for this ontology type
-                if input_availability.get(ontology_type, False):
-                    ontology_stats[ontology_type]["total_with_input"] += 1
-                    if match_status != "unknown":
-                        ontology_stats[ontology_type]["matched"] += 1
-                    else:
-                        ontology_stats[ontology_type]["unknown"] += 1
+            # Best mapped drug: at least 3 ontology types matched. A drug with no more ontology
+            # types than the current best cannot beat it, so its matches are not counted
+            if len(ontology) > best_count:
+                match_count = 0
+                for o in ontology.values():
+                    if o.get("match_status") != "unknown":
+                        match_count += 1
+                if match_count > best_count:
+                    best_count = match_count
+                    best_mapped = (entry, drug, match_count)
     
-    # Print results
+    ontology_stats = {
+        ontology_type: {"matched": matched_counter[ontology_type],
+                        "unknown": total_with_input - matched_counter[ontology_type],
+                        "total_with_input": total_with_input}
+        for ontology_type, total_with_input in input_counter.items()
+    }
+    enriched_stats = {
+        field_type: {"cleaned": cleaned_counter[field_type],
+                     "unknown": total_with_input - cleaned_counter[field_type],
+                     "total_with_input": total_with_input}
+        for field_type, total_with_input in enriched_input_counter.items()
+    }
+    return Report(total_entries, total_drugs, ontology_stats, enriched_stats, structure_errors,
+                  unexamined_entries, best_mapped)
+
+def analyze_enriched_data(report):
+    """Print ontology match rates and return the per-type stats"""
+    print("📊 Analyzing enriched data...")
     print(f"📈 Summary Statistics:")
-    print(f"   • Total entries: {total_entries}")
-    print(f"   • Total drugs: {total_drugs}")
+    print(f"   • Total entries: {report.total_entries}")
+    print(f"   • Total drugs: {report.total_drugs}")
     print()
     
     print("🎯 Ontology Match Rates (based on drugs with input data):")
-    for ontology_type, stats in ontology_stats.items():
+    for ontology_type, stats in report.ontology_stats.items():
         total_with_input = stats["total_with_input"]
         if total_with_input > 0:
             match_rate = stats["matched"] / total_with_input * 100
@@ -89,65 +179,24 @@ def analyze_enriched_data(data):
         else:
             print(f"   • {ontology_type}: No input data available")
     
-    return ontology_stats
+    return report.ontology_stats
 
-def analyze_enriched_fields(data):
-    """Analyze the enriched fields (company, trial design, biomarker strategy)"""
+def analyze_enriched_fields(report):
+    """Print success rates for the enriched fields (company, trial design, biomarker strategy)"""
     print("📊 Analyzing enriched fields...")
-    
-    total_entries = len(data)
-    total_drugs = 0
-    enriched_stats = defaultdict(lambda: {"cleaned": 0, "unknown": 0, "total_with_input": 0})
-    
-    # Collect statistics
-    for entry in data:
-        for drug in entry.get("extractedDrugs", []):
-            total_drugs += 1
-            ontology = drug.get("ontology", {})
-            # Check company enrichment
-            has_company_input = drug.get("company") and drug.get("company") != "unknown"
-            company_data = ontology.get("company", {})
-            company_cleaned = company_data.get("companyCleaned") if isinstance(company_data, dict) else None
-            if has_company_input:
-                enriched_stats["company"]["total_with_input"] += 1
-                if company_cleaned and company_cleaned != "unknown":
-                    enriched_stats["company"]["cleaned"] += 1
-                else:
-                    enriched_stats["company"]["unknown"] += 1
-            # Check trial design enrichment
-            has_trial_design_input = drug.get("trialDesign") and drug.get("trialDesign") != "unknown"
-            trial_design_data = ontology.get("trial_design", {})
-            trial_design_cleaned = trial_design_data.get("trialDesignCleaned") if isinstance(trial_design_data, dict) else None
-            if has_trial_design_input:
-                enriched_stats["trial_design"]["total_with_input"] += 1
-                if trial_design_cleaned and trial_design_cleaned != "unknown":
-                    enriched_stats["trial_design"]["cleaned"] += 1
-                else:
-                    enriched_stats["trial_design"]["unknown"] += 1
-            # Check biomarker strategy enrichment
-            has_biomarker_input = drug.get("biomarkerStrategy") and drug.get("biomarkerStrategy") != "unknown"
-            biomarker_data = ontology.get("biomarker_strategy", {})
-            biomarker_cleaned = biomarker_data.get("biomarkerStrategyCleaned") if isinstance(biomarker_data, dict) else None
-            if has_biomarker_input:
-                enriched_stats["biomarker_strategy"]["total_with_input"] += 1
-                if biomarker_cleaned and biomarker_cleaned != "unknown":
-                    enriched_stats["biomarker_strategy"]["cleaned"] += 1
-                else:
-                    enriched_stats["biomarker_strategy"]["unknown"] += 1
-    # Print results
     print(f"📈 Enriched Fields Statistics:")
-    print(f"   • Total entries: {total_entries}")
-    print(f"   • Total drugs: {total_drugs}")
+    print(f"   • Total entries: {report.total_entries}")
+    print(f"   • Total drugs: {report.total_drugs}")
     print()
     print("🎯 Enriched Fields Success Rates:")
-    for field_type, stats in enriched_stats.items():
+    for field_type, stats in report.enriched_stats.items():
         total_with_input = stats["total_with_input"]
         if total_with_input > 0:
             success_rate = stats["cleaned"] / total_with_input * 100
             print(f"   • {field_type}: {success_rate:.1f}% ({stats['cleaned']}/{total_with_input})")
         else:
             print(f"   • {field_type}: No input data available")
-    return enriched_stats
+    return report.enriched_stats
 
 def validate_dictionaries():
     """Validate that all dictionary files exist and are valid JSON"""
@@ -164,9 +213,12 @@ def validate_dictionaries():
         "dictionaries/biomarker/biomarker_strategy_dictionary.json"
     ]
     
+    # Each file is an independent load, so read and parse them concurrently
+    with ThreadPoolExecutor(max_workers=len(dictionary_files)) as executor:
+        loaded = list(executor.map(load_json_safe, dictionary_files))
+    
     valid_files = 0
-    for file_path in dictionary_files:
-        data = load_json_safe(file_path)
+    for file_path, data in zip(dictionary_files, loaded):
         if data is not None:
             print(f"   ✅ {file_path}")
             valid_files += 1
@@ -176,64 +228,32 @@ def validate_dictionaries():
     print(f"\n📁 Dictionary validation: {valid_files}/{len(dictionary_files)} files valid")
     return valid_files == len(dictionary_files)
 
-def check_data_structure(data):
-    """Check that the data structure is correct"""
+def check_data_structure(report):
+    """Report whether the data structure is correct"""
     print("🔧 Validating data structure...")
     
-    required_fields = ["id", "extractedDrugs"]
-    ontology_fields = ["drug", "antigen", "disease", "payload", "linker", "company", "trial_design", "biomarker_strategy"]
-    
-    structure_errors = []
-    
-    for i, entry in enumerate(data):
-        # Check required fields
-        for field in required_fields:
-            if field not in entry:
-                structure_errors.append(f"Entry {i}: Missing required field '{field}'")
-        
-        # Check drug ontology structure
-        for j, drug in enumerate(entry.get("extractedDrugs", [])):
-            ontology = drug.get("ontology", {})
-            
-            for ontology_type in ontology_fields:
-                if ontology_type not in ontology:
-                    structure_errors.append(f"Entry {i}, Drug {j}: Missing ontology field '{ontology_type}'")
-                else:
-                    ontology_data = ontology[ontology_type]
-                    if ontology_type in ["drug", "antigen", "disease", "payload", "linker"]:
-                        if "match_status" not in ontology_data:
-                            structure_errors.append(f"Entry {i}, Drug {j}: Missing match_status in {ontology_type}")
-                    else:
-                        if not isinstance(ontology_data, dict):
-                            structure_errors.append(f"Entry {i}, Drug {j}: '{ontology_type}' is not a dictionary")
-    
+    structure_errors = report.structure_errors
     if structure_errors:
         print("   ❌ Structure validation failed:")
         for error in structure_errors[:5]:  # Show first 5 errors
-            print(f"      • {error}")
+            print(f"      • {format_structure_error(error)}")
         if len(structure_errors) > 5:
             print(f"      ... and {len(structure_errors) - 5} more errors")
+        if report.unexamined_entries:
+            print(f"      ... {report.unexamined_entries} more entries not examined "
+                  f"(stopped after {MAX_STRUCTURE_ERRORS} errors)")
         return False
     else:
         print("   ✅ Data structure is valid")
         return True
 
-def sample_analysis(data):
+def sample_analysis(report):
     """Provide a sample analysis of the enriched data"""
     print("\n🔬 Sample Analysis:")
     
-    # Find entries with good ontology coverage
-    well_mapped_entries = []
-    for entry in data:
-        for drug in entry.get("extractedDrugs", []):
-            ontology = drug.get("ontology", {})
-            match_count = sum(1 for o in ontology.values() if o.get("match_status") != "unknown")
-            if match_count >= 3:  # At least 3 ontology types matched
-                well_mapped_entries.append((entry, drug, match_count))
-    
-    if well_mapped_entries:
+    if report.best_mapped:
         # Show best mapped example
-        best_entry, best_drug, best_count = max(well_mapped_entries, key=lambda x: x[2])
+        best_entry, best_drug, best_count = report.best_mapped
         
         print(f"   📋 Best mapped drug: {best_drug.get('drugName', 'Unknown')}")
         print(f"      • Ontology matches: {best_count}/5")
@@ -261,18 +281,21 @@ def main():
         sys.exit(1)
     
     # Load and analyze data
-    data = load_json_safe(enriched_file)
+    data = load_json_safe(enriched_file, memoize=False)
     if data is None:
         sys.exit(1)
     
     print(f"✅ Loaded {len(data)} entries from {enriched_file}")
     
-    # Run tests
-    ontology_stats = analyze_enriched_data(data)
-    enriched_stats = analyze_enriched_fields(data)
+    # Run tests off one shared pass over the data; build_report takes any iterable of entries,
+    # and the corpus is released once it has been summarized
+    report = build_report(data)
+    del data
+    ontology_stats = analyze_enriched_data(report)
+    enriched_stats = analyze_enriched_fields(report)
     dict_valid = validate_dictionaries()
-    structure_valid = check_data_structure(data)
-    sample_analysis(data)
+    structure_valid = check_data_structure(report)
+    sample_analysis(report)
     
     # Summary
     print("\n" + "=" * 50)